@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""
+Decides which of the clients (browsers etc.) connected to the robot is allowed to drive it.
+
+One client at a time holds a lease to drive; each command it sends renews the lease. Any other client is a spectator and its
+motor commands are rejected before they get anywhere near the motors. When the driver releases the lease (or stops sending
+commands for leasetime seconds) the next client to send a command (or ask to drive) takes over straight away.
+
+Each client is also limited to one command every mininterval seconds (the rate the motors can actually use), except that a
+stop is always accepted.
+"""
+import math, threading, time
+
+ACCEPTED    = 'accepted'
+SPECTATOR   = 'spectator'
+TOOFAST     = 'toofast'
+
+class clientinfo():
+    """
+    The counts and command rate for a single client
+    """
+    def __init__(self, now):
+        self.accepted=0
+        self.rejected=0
+        self.toofast=0
+        self.rate=0
+        self.lastseen=now
+        self.lastaccepted=None
+
+    def count(self, now, result, tau):
+        """
+        updates the counts and the command rate (an exponentially weighted average with time constant tau)
+        """
+        self.rate=self.rate*math.exp(-(now-self.lastseen)/tau)+1/tau
+        self.lastseen=now
+        if result==ACCEPTED:
+            self.accepted+=1
+            self.lastaccepted=now
+        elif result==TOOFAST:
+            self.toofast+=1
+        else:
+            self.rejected+=1
+
+    def getstate(self, now, tau):
+        return {'rate': round(self.rate*math.exp(-(now-self.lastseen)/tau), 2), 'accepted': self.accepted,
+                'rejected': self.rejected, 'toofast': self.toofast, 'idle': round(now-self.lastseen, 1)}
+
+class driverarbiter():
+    def __init__(self, leasetime=2, mininterval=0, ratetau=2, forget=60, maxhold=300):
+        """
+        leasetime  : seconds after the driver's last command that the lease expires, 0 lets every client drive
+        mininterval: minimum time in seconds between commands accepted from a client (other than stops)
+        ratetau    : time constant in seconds for the per client command rates
+        forget     : clients not heard from for this many seconds are dropped from the stats
+        maxhold    : the longest holdfor allowed (see command), so no client can keep the lease for ever
+        """
+        self.leasetime=leasetime
+        self.maxhold=maxhold
+        self.mininterval=mininterval
+        self.ratetau=ratetau
+        self.forget=forget
+        self.lock=threading.Lock()
+        self.driver=None
+        self.leaseend=0
+        self.handovers=0
+        self.clients={}
+
+    def _holds(self, clientid, now, holdfor=0):
+        """
+        returns True if the client holds (or can take) the lease, taking or renewing it - the lock must be held
+        """
+        if self.leasetime <= 0:
+            return True
+        if self.driver != clientid:
+            if not self.driver is None and now < self.leaseend:
+                return False
+            self.driver=clientid
+            self.handovers+=1
+        if math.isnan(holdfor):
+            holdfor=0
+        self.leaseend=now+max(self.leasetime, min(holdfor, self.maxhold))
+        return True
+
+    def command(self, clientid, isstop=False, holdfor=0):
+        """
+        called for each motor command, returns ACCEPTED if the command should be actioned, SPECTATOR if another client is
+        driving or TOOFAST if this client has sent commands faster than mininterval allows.
+
+        isstop : True if the command stops the motors - stops are never rejected as too fast
+        holdfor: for commands that keep the motors busy (such as a trajectory), the lease is held for at least this many seconds
+                 (up to maxhold)
+        """
+        now=time.monotonic()
+        with self.lock:
+            cinfo=self.clients.get(clientid)
+            if cinfo is None:
+                cinfo=self.clients[clientid]=clientinfo(now)
+            if not isstop and not cinfo.lastaccepted is None and now-cinfo.lastaccepted < self.mininterval:
+                result=TOOFAST
+            elif self._holds(clientid, now, holdfor):
+                result=ACCEPTED
+            else:
+                result=SPECTATOR
+            cinfo.count(now, result, self.ratetau)
+        return result
+
+    def take(self, clientid):
+        """
+        asks to become the driver without sending a motor command, returns True if successful
+        """
+        with self.lock:
+            return self._holds(clientid, time.monotonic())
+
+    def heartbeat(self, clientid):
+        """
+        called for each dead-man heartbeat from a client, returns True (and renews the lease) if the client is the driver
+        """
+        if self.leasetime <= 0:
+            return True
+        now=time.monotonic()
+        with self.lock:
+            if self.driver==clientid and now < self.leaseend:
+                self.leaseend=now+self.leasetime
+                return True
+            return False
+
+    def release(self, clientid):
+        """
+        gives up the lease (if this client holds it) so another client can take over at once
+        """
+        with self.lock:
+            if self.driver==clientid:
+                self.driver=None
+                self.leaseend=0
+
+    def getdriver(self):
+        """
+        returns the id of the current driver, or None if no client holds a lease
+        """
+        if self.leasetime <= 0 or time.monotonic() >= self.leaseend:
+            return None
+        return self.driver
+
+    def getstate(self):
+        """
+        returns a dict with the current driver (everyone is True if there is no lease, so every client can drive) and the stats
+        for each client, suitable for telemetry
+        """
+        now=time.monotonic()
+        with self.lock:
+            for cid in [cid for cid, cinfo in self.clients.items() if now-cinfo.lastseen > self.forget]:
+                del self.clients[cid]
+            return {'driver': self.driver if now < self.leaseend else None, 'everyone': self.leasetime <= 0,
+                    'leaseleft': round(max(self.leaseend-now, 0), 2), 'handovers': self.handovers,
+                    'clients': {cid: cinfo.getstate(now, self.ratetau) for cid, cinfo in self.clients.items()}}
@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+"""
+Works out a speed table for each motor (see defaultspeedtable1000 in phatpigpio.py) instead of tuning one by hand.
+
+Each motor's duty cycle is swept from 0 to full at each of a list of pwm frequencies, and the steady rpm at each step is measured
+with the motor's rotation sensor (so the motors need senseparams in the config file). A table is then fitted that maps speeds
+0 - 1000 to the frequency and duty cycle giving an rpm proportional to the speed, keeping the rpm within the requested linearity
+(as a percentage of full speed) with few entries. The search for the fewest entries assumes that once a span between two
+entries is too far out a longer one will be too, so it is a good fit rather than a guaranteed smallest one. The lowest frequency that can reach each speed is used,
+as low frequencies keep the motor turning at lower speeds.
+
+The tables are written to a python file, which can be imported by a config file, for example:
+
+    from speedtables import speedtables, maxrpm
+    ... motor(speedtable=speedtables['left']) ...
+
+The measured full speed rpm of each motor can also be given to closed loop speed control (speedcontrol={'maxrpm': maxrpm}).
+The tables are not suitable as its feed-forward tables, as they change the pwm frequency along the table and speed control
+only uses the duty cycle.
+
+With -s the sweep is run against simulated motors (fakemotors) using a simulated clock, so it only takes a moment:
+
+    python3 calibrate.py -s trike-config
+
+Against real motors the wheels must be off the ground, the sweep drives every motor up to full speed:
+
+    python3 calibrate.py -p /home/pi/gitbits/pimotors trike-config
+"""
+import argparse, importlib, math, os, sys, time
+import odometry
+
+DEFPIMOTORLIB   = "/home/pi/gitbits/pimotors"
+DEFFREQUENCIES  = (10, 20, 40, 100)
+DEFSTEPS        = 30
+DEFLINEARITY    = 2
+DEFSETTLE       = 1
+DEFMEASURE      = 2
+DEFOUTPUT       = 'speedtables.py'
+DEFRESOLUTION   = 5
+
+class simclock():
+    """
+    A clock for simulated motors that only moves on when asked, in small steps so the motor models stay accurate. Motors
+    that cannot use another clock (real motors) are left alone.
+    """
+    def __init__(self, motors=(), step=.01):
+        self.t=0
+        self.step=step
+        self.motors=[]
+        self.addmotors(motors)
+
+    def addmotors(self, motors):
+        """
+        moves more motors over to this clock
+        """
+        for m in motors:
+            if hasattr(m, 'clock'):
+                m.clock=self.now
+                m.lastupdate=self.t
+                self.motors.append(m)
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        end=self.t+seconds
+        while self.t < end:
+            self.t=min(self.t+self.step, end)
+            for m in self.motors:
+                m.getrpm()
+
+def sweep(motors, wheels, frequencies, steps=DEFSTEPS, settle=DEFSETTLE, measure=DEFMEASURE, sleep=time.sleep,
+            clock=time.monotonic, progress=None):
+    """
+    runs all the motors together through each frequency and duty cycle, returns a dict of motor name: {frequency: list of
+    (dutycycle, rpm)}
+
+    motors     : dict of motor name: motor, each motor must have DC and maxDC methods, and setFrequency to sweep frequencies
+    wheels     : dict of motor name: (edgecounter, edges per revolution) - see odometry.makewheels
+    frequencies: the pwm frequencies to try (only the first is used if the motors cannot change frequency)
+    steps      : number of duty cycle steps from 0 to full
+    settle     : seconds to wait after each change before measuring
+    measure    : seconds over which the rpm is measured
+    sleep      : function used to wait
+    clock      : function that returns the time in seconds
+    progress   : if not None, called with a message after each frequency is done
+    """
+    canfreq=all(hasattr(m, 'setFrequency') for m in motors.values())
+    curves={mname: {} for mname in motors}
+    for freq in frequencies if canfreq else frequencies[:1]:
+        if canfreq:
+            for m in motors.values():
+                m.setFrequency(freq)
+        for mname in motors:
+            curves[mname][freq]=[]
+        for step in range(steps+1):
+            for mname, m in motors.items():
+                m.DC(int(round(m.maxDC()*step/steps)))
+            sleep(settle)
+            started=clock()
+            counts={mname: wheels[mname][0].count() for mname in motors}
+            sleep(measure)
+            elapsed=clock()-started
+            for mname, m in motors.items():
+                counter, epr = wheels[mname]
+                curves[mname][freq].append((int(round(m.maxDC()*step/steps)), (counter.count()-counts[mname])/epr/elapsed*60))
+        for m in motors.values():
+            m.DC(0)
+        sleep(settle)
+        if not progress is None:
+            progress('%dHz swept' % freq)
+    return curves
+
+def makemonotonic(curve):
+    """
+    returns the curve (list of (dutycycle, rpm)) with the rpm never falling as the duty cycle rises, to even out measuring noise
+    """
+    mono=[]
+    top=0
+    for dc, rpm in curve:
+        top=max(top, rpm)
+        mono.append((dc, top))
+    return mono
+
+def rpmat(curve, dc):
+    """
+    returns the rpm for a duty cycle, interpolated from a (monotonic) curve
+    """
+    for (dca, rpma), (dcb, rpmb) in zip(curve, curve[1:]):
+        if dc <= dcb:
+            return rpma if dcb==dca else rpma+(rpmb-rpma)*(dc-dca)/(dcb-dca)
+    return curve[-1][1]
+
+def dcfor(curve, rpm):
+    """
+    returns the lowest duty cycle that gives the rpm, interpolated from a (monotonic) curve
+    """
+    for (dca, rpma), (dcb, rpmb) in zip(curve, curve[1:]):
+        if rpm <= rpmb and rpmb > rpma:
+            return dca+(dcb-dca)*max(rpm-rpma, 0)/(rpmb-rpma)
+    return curve[-1][0]
+
+def tablelookup(table, speed):
+    """
+    returns the (frequency, dutycycle) for a speed from a speed table, in the same way as phatpigpio.motor.speed
+    """
+    i=0
+    while i < len(table) and table[i][0] < speed:
+        i+=1
+    if i >= len(table):
+        return table[-1][1], table[-1][2]
+    if i==0 or table[i][0]==speed:
+        return table[i][1], table[i][2]
+    enta, entb = table[i-1], table[i]
+    return enta[1], int(round(enta[2]+(entb[2]-enta[2])*(speed-enta[0])/(entb[0]-enta[0])))
+
+def fittable(curves, linearity=DEFLINEARITY, resolution=DEFRESOLUTION):
+    """
+    fits a speed table to the measured curves of a single motor, returns a tuple of (table, full speed rpm, worst error as a
+    percentage of full speed)
+
+    curves    : dict of frequency: list of (dutycycle, rpm) - see sweep
+    linearity : largest error allowed, as a percentage of full speed
+    resolution: the step in speed (0 - 1000) at which the fit is checked
+    """
+    curves={freq: makemonotonic(curve) for freq, curve in curves.items()}
+    freqs=sorted(curves.keys())
+    fullrpm=max(curve[-1][1] for curve in curves.values())
+    if fullrpm <= 0:
+        raise ValueError('motor did not turn')
+    minrpm=min(min(rpm for dc, rpm in curve if rpm > 0) for curve in curves.values() if curve[-1][1] > 0)
+    minspeed=min(max(int(math.ceil(minrpm/fullrpm*1000)), 1), 1000)
+    tol=fullrpm*linearity/100
+    # the ideal frequency and duty cycle at each speed checked, including both sides of each change of frequency
+    speeds=set(range(minspeed, 1000, resolution))
+    speeds.add(1000)
+    for curve in curves.values():
+        topspeed=int(curve[-1][1]/fullrpm*1000+.001)
+        if minspeed <= topspeed < 1000:
+            speeds.update((topspeed, topspeed+1))
+    ideal=[]
+    for speed in sorted(speeds):
+        rpm=speed/1000*fullrpm
+        freq=[f for f in freqs if curves[f][-1][1] >= rpm-.001][0]
+        ideal.append((speed, freq, int(round(dcfor(curves[freq], rpm)))))
+
+    def spanok(i, j):
+        # can entries i and j be adjacent in the table?
+        speeda, freq, dca = ideal[i]
+        speedb, _, dcb = ideal[j]
+        if any(f != freq for speed, f, dc in ideal[i:j]):
+            return False
+        for speed in [ideal[k][0] for k in range(i+1, j)]+[speedb-1]:
+            tdc=int(round(dca+(dcb-dca)*(speed-speeda)/(speedb-speeda)))
+            if abs(rpmat(curves[freq], tdc)-speed/1000*fullrpm) > tol:
+                return False
+        return True
+
+    # fewest entries from the first ideal point to the last, a span that fails is assumed to fail if made longer
+    best=[None]*len(ideal)
+    best[0]=(1, None)
+    for i in range(len(ideal)-1):
+        if best[i] is None:
+            continue
+        for j in range(i+1, len(ideal)):
+            if not spanok(i, j):
+                if j==i+1:      # adjacent points must always be allowed
+                    if best[j] is None or best[i][0]+1 < best[j][0]:
+                        best[j]=(best[i][0]+1, i)
+                break
+            if best[j] is None or best[i][0]+1 < best[j][0]:
+                best[j]=(best[i][0]+1, i)
+    picks=[]
+    j=len(ideal)-1
+    while not j is None:
+        picks.append(j)
+        j=best[j][1]
+    table=[ideal[k] for k in reversed(picks)]
+    if minspeed > 1:
+        table=[(0, table[0][1], 0), (minspeed-1, table[0][1], 0)]+table
+    else:
+        table=[(0, table[0][1], 0)]+table
+    worst=max(abs(rpmat(curves[f], dc)-speed/1000*fullrpm) for speed in range(minspeed, 1001)
+            for f, dc in (tablelookup(table, speed),))
+    return tuple(table), fullrpm, worst/fullrpm*100
+
+def writetables(filename, tables, fullrpms, source, linearity):
+    """
+    writes the tables as a python module with a dict speedtables (motor name: table) and a dict maxrpm (motor name: rpm at full
+    speed)
+    """
+    with open(filename, 'w') as tfile:
+        tfile.write('#!/usr/bin/python3\n')
+        tfile.write('# speed tables written by calibrate.py from %s on %s, linearity %3.1f%% of full speed\n' % (
+                source, time.strftime('%Y-%m-%d %H:%M'), linearity))
+        tfile.write('# use with phatpigpio.motor(speedtable=speedtables[name]), maxrpm can also be used with '
+                'speedcontrol={\'maxrpm\': maxrpm}\n\n')
+        tfile.write('maxrpm={\n')
+        for mname in sorted(fullrpms):
+            tfile.write('    %r: %.1f,\n' % (mname, fullrpms[mname]))
+        tfile.write('}\n\nspeedtables={\n')
+        for mname in sorted(tables):
+            tfile.write('    %r: (\n' % mname)
+            for speed, freq, dc in tables[mname]:
+                tfile.write('        (%4d, %4d, %5d),\n' % (speed, freq, dc))
+            tfile.write('    ),\n')
+        tfile.write('}\n')
+
+if __name__ == '__main__':
+    clparse = argparse.ArgumentParser(description='sweeps the motors in a config file through frequencies and duty cycles '
+            'and writes a speed table for each. The motors need rotation sensors (senseparams).')
+    clparse.add_argument( "-s", "--simulate", action='store_true', help="use simulated motors (fakemotors) and a simulated clock")
+    clparse.add_argument( "-p", "--pimotorlib", default=DEFPIMOTORLIB,
+        help="pimotors library (ignored with -s), default %s" % DEFPIMOTORLIB)
+    clparse.add_argument( "-f", "--frequencies", type=int, nargs='+', default=DEFFREQUENCIES,
+        help="pwm frequencies to try, default %s" % ' '.join(str(f) for f in DEFFREQUENCIES))
+    clparse.add_argument( "-n", "--steps", type=int, default=DEFSTEPS, help="duty cycle steps, default %d" % DEFSTEPS)
+    clparse.add_argument( "-l", "--linearity", type=float, default=DEFLINEARITY,
+        help="largest rpm error allowed, as a percentage of full speed, default %3.1f" % DEFLINEARITY)
+    clparse.add_argument( "-t", "--settle", type=float, default=DEFSETTLE,
+        help="seconds to let each motor settle after each change, default %3.1f" % DEFSETTLE)
+    clparse.add_argument( "-m", "--measure", type=float, default=DEFMEASURE,
+        help="seconds to count sensor edges for at each step, default %3.1f" % DEFMEASURE)
+    clparse.add_argument( "-o", "--output", default=DEFOUTPUT, help="file the tables are written to, default %s" % DEFOUTPUT)
+    clparse.add_argument('config', help='configuration file with the motors to calibrate')
+    args=clparse.parse_args()
+    sys.path.insert(1, 'fakemotors' if args.simulate else args.pimotorlib)
+    sys.path.insert(1, os.getcwd())
+    conf=importlib.import_module(args.config)
+    import motorset
+    mset=motorset.motorset(motordefs=conf.motordef)
+    wheels=odometry.makewheels(conf.motordef, motors=mset.motors)
+    motors={mname: mset.motors[mname] for mname in wheels}
+    if not motors:
+        print('no motors with rotation sensors in %s' % args.config)
+        sys.exit(1)
+    if args.simulate:
+        sclock=simclock(motors.values())
+        sleep, clock = sclock.sleep, sclock.now
+    else:
+        print('sweeping motors %s up to full speed - the wheels must be off the ground' % ', '.join(motors))
+        sleep, clock = time.sleep, time.monotonic
+    try:
+        curves=sweep(motors, wheels, args.frequencies, steps=args.steps, settle=args.settle, measure=args.measure,
+                sleep=sleep, clock=clock, progress=print)
+    except KeyboardInterrupt:
+        curves=None
+    mset.close()
+    if not curves is None:
+        tables={}
+        fullrpms={}
+        for mname, mcurves in curves.items():
+            tables[mname], fullrpms[mname], worst = fittable(mcurves, linearity=args.linearity)
+            print('motor %s: full speed %5.1frpm, %d table entries, worst error %3.1f%% of full speed' % (
+                    mname, fullrpms[mname], len(tables[mname]), worst))
+        writetables(args.output, tables, fullrpms, args.config, args.linearity)
+        print('tables written to %s' % args.output)
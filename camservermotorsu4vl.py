@@ -6,15 +6,83 @@ import importlib
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs
 from socketserver import ThreadingMixIn
-import json
+import json, threading, time
+import arbiter as arbitermod
+from fleet import GATEWAYCLIENT
 
-indexbase={'ok':'index.html','off':'index_off.html','na':'index_nocam.html'}
+indexbase={'ok':'index.html','off':'index_off.html','na':'index_nocam.html','fleet':'fleet.html'}
+
+def getcputemp():
+    """
+    returns the cpu temperature in degrees C, or None if it is not available
+    """
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp') as cput:
+            return int(cput.readline().strip())/1000
+    except (OSError, ValueError):
+        return None
+
+def governorsample():
+    """
+    returns the cpu temperature and the throttled state for the load governor
+    """
+    import pistatus, subprocess
+    try:
+        throttled=pistatus.get_state('throttled')
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        throttled=None
+    return getcputemp(), throttled
+
+def governorchange(settings):
+    """
+    called by the load governor when its level changes - the sensor period only matters if the ultrasonic sensors are
+    running, which the server does not start at present, so usens is always None and only the settings the web page reads from
+    the telemetry (polling interval and frame rate) have any effect
+    """
+    if not usens is None:
+        usens.setperiod(settings['sensorperiod'])
+
+def gettelemetry():
+    """
+    returns a dict with the cpu temperature, latest sensor readings and motor state
+    """
+    return {
+        'cputemp': getcputemp(),
+        'sensors': None if usens is None else usens.getlastgood(),
+        'motors' : None if mdrive is None else mdrive.getstate(),
+        'governor': None if governor is None else governor.getstate(),
+        'drivers': None if arbiter is None else arbiter.getstate(),
+        'control': None if mdrive is None else mdrive.getcontrolparams(),
+        'odometry': None if odo is None else odo.getstate(),
+        'trajectory': None if mdrive is None else mdrive.trajectorystate(),
+        'udp': None if udpctl is None else udpctl.getstate(),
+        'pollms' : int(1000*(DEFTELEMETRYPERIOD if governor is None else governor.settings()['telemetryperiod'])),
+    }
+
+telemetrylock=threading.Lock()
+telemetrycache={'tstamp': 0, 'json': None}
+
+def sharedtelemetry():
+    """
+    returns the telemetry as a json string. It is only rebuilt if the last one is more than TELEMETRYMAXAGE seconds old,
+    so any number of clients polling cost (roughly) the same as one.
+    """
+    with telemetrylock:
+        now=time.monotonic()
+        if now-telemetrycache['tstamp'] > TELEMETRYMAXAGE:
+            telemetrycache['json']=json.dumps(gettelemetry())
+            telemetrycache['tstamp']=now
+        return telemetrycache['json']
 
 class camhandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep connections open so pollers and gateways can re-use them
+
     def do_GET(self):
         pr = urlparse(self.path)
         pf = pr.path.split('/')
-        if pf[-1] == '' or pf[-1] == 'index.html':
+        if not gateway is None:
+            self.gatewayGET(pr, pf)
+        elif pf[-1] == '' or pf[-1] == 'index.html':
             sfp=Path(indexfiles[camstate])
             pstr = self.headers['Host'].split(':')
             pstr[-1] = '8080'
@@ -27,20 +95,78 @@ class camhandler(http.server.BaseHTTPRequestHandler):
             if qu and 'speed' in qu and 'turn' in qu:
                 speed=int(qu['speed'][0])
                 turn=int(qu['turn'][0])
-                if not mdrive is None:
-                    mdrive.setspeeddir(speedf=speed, dirf=turn)
-            self.simpleSend('boo')
+                cmdres=arbitermod.ACCEPTED if arbiter is None else arbiter.command(self.clientid(qu), isstop=speed==0 and turn==0)
+                if cmdres==arbitermod.ACCEPTED:
+                    if not journ is None:
+                        journ.record('setspeedturn2', speed, turn)
+                    if not mdrive is None:
+                        mdrive.setspeeddir(speedf=speed, dirf=turn)
+                    self.simpleSend('boo')
+                elif cmdres==arbitermod.TOOFAST:
+                    self.simpleSend(cmdres, status=429)
+                else:
+                    self.simpleSend(cmdres, status=409)
+            else:
+                self.simpleSend('boo')
+        elif pf[-1] == 'trajectory':
+            qu = parse_qs(pr.query) if pr.query else {}
+            if mdrive is None:
+                self.send_error(404, 'no motors')
+            elif qu.get('action', ('state',))[0] == 'cancel':
+                if arbiter is None or arbiter.command(self.clientid(qu), isstop=True)==arbitermod.ACCEPTED:
+                    if not journ is None:
+                        journ.record('canceltrajectory')
+                    mdrive.canceltrajectory()
+                    self.simpleSend(json.dumps(mdrive.trajectorystate()), 'application/json')
+                else:
+                    self.simpleSend(arbitermod.SPECTATOR, status=409)
+            else:
+                self.simpleSend(json.dumps(mdrive.trajectorystate()), 'application/json')
+        elif pf[-1] == 'drive':
+            qu = parse_qs(pr.query) if pr.query else {}
+            if arbiter is None:
+                self.simpleSend('driver')
+            elif qu.get('action', ('take',))[0] == 'release':
+                arbiter.release(self.clientid(qu))
+                self.simpleSend('spectator')
+            elif arbiter.take(self.clientid(qu)):
+                self.simpleSend('driver')
+            else:
+                self.simpleSend('spectator', status=409)
+        elif pf[-1]=='hb':
+            # dead-man heartbeat from the driver, kept as cheap as possible as it arrives several times a second
+            qu = parse_qs(pr.query) if pr.query else {}
+            if mdrive is None:
+                self.send_error(404, 'no motors')
+            elif arbiter is None or arbiter.heartbeat(self.clientid(qu)):
+                mdrive.heartbeat()
+                self.simpleSend('hb')
+            else:
+                self.simpleSend(arbitermod.SPECTATOR, status=409)
         elif pf[-1]=='cputemp':
-            with open('/sys/class/thermal/thermal_zone0/temp') as cput:
-                tstr='%3.1f' % (int(cput.readline().strip())/1000)
-            self.simpleSend(tstr)
+            if not journ is None:
+                journ.record('cputemp')
+            ctemp=getcputemp()
+            self.simpleSend('?' if ctemp is None else '%3.1f' % ctemp)
             if not mdrive is None:
                 mdrive.sendkwac()
+        elif pf[-1]=='telemetry':
+            if not journ is None:
+                journ.record('telemetry')
+            self.simpleSend(sharedtelemetry(), 'application/json')
+            qu = parse_qs(pr.query) if pr.query else {}
+            if not mdrive is None and self.clientid(qu) != GATEWAYCLIENT:
+                # the gateway polls regardless of whether anyone is watching, so it must not keep the watchdog happy
+                mdrive.sendkwac()
         elif pf[-1]=='sensors':
-            if usens is None:
-                self.send_response(404)
+            if not journ is None:
+                journ.record('sensors')
+            if usens is None and odo is None:
+                self.send_error(404, 'no sensors running')
             else:
-                lastreadings=usens.getlastgood()
+                lastreadings={} if usens is None else usens.getlastgood()
+                if not odo is None:
+                    lastreadings['odometry']=odo.getstate()
                 datats=json.dumps(lastreadings)
                 self.simpleSend(datats)
             if not mdrive is None:
@@ -53,11 +179,82 @@ class camhandler(http.server.BaseHTTPRequestHandler):
             self.send_error(404,"I think there may be an error - I only do jpegs (%s)" % pf[-1])
             return
 
-    def simpleSend(self, thcontent):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html; charset=utf-8')
+    def do_POST(self):
+        pr = urlparse(self.path)
+        pf = pr.path.split('/')
+        clen=int(self.headers.get('Content-Length', 0))
+        body=self.rfile.read(clen) if clen > 0 else b''
+        if gateway is None and pf[-1] == 'trajectory' and not mdrive is None:
+            # body is json: {"points": [[time offset, speed, turn], ...]} see motoradds.parsetrajectory
+            qu = parse_qs(pr.query) if pr.query else {}
+            try:
+                trajreq=json.loads(body.decode('utf-8'))
+                points=trajreq['points']
+                steps=motoradds.parsetrajectory(points)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_error(400, 'bad trajectory: %s' % str(e))
+                return
+            cmdres=arbitermod.ACCEPTED if arbiter is None else arbiter.command(self.clientid(qu), holdfor=steps[-1][0])
+            if cmdres==arbitermod.ACCEPTED:
+                if not journ is None:
+                    journ.recordtrajectory(steps)
+                mdrive.runtrajectory(points)
+                self.simpleSend(json.dumps(mdrive.trajectorystate()), 'application/json')
+            else:
+                self.simpleSend(cmdres, status=409 if cmdres==arbitermod.SPECTATOR else 429)
+        else:
+            self.send_error(404, "I don't know what to do with that (%s)" % pf[-1])
+
+    def gatewayGET(self, pr, pf):
+        """
+        handles requests when running as a gateway to a fleet of robots
+        """
+        if pf[-1] == '' or pf[-1] == 'index.html':
+            sfp=Path(indexfiles['fleet'])
+            with sfp.open('r') as sfile:
+                self.simpleSend(sfile.read())
+        elif pf[-1] == 'setspeedturn2':
+            qu = parse_qs(pr.query) if pr.query else ()
+            if qu and 'robot' in qu and 'speed' in qu and 'turn' in qu:
+                rstat=gateway.setspeedturn(qu['robot'][0], speed=int(qu['speed'][0]), turn=int(qu['turn'][0]))
+                if rstat==200:
+                    self.simpleSend('boo')
+                else:
+                    self.send_error(rstat, 'robot %s did not accept the command' % qu['robot'][0])
+            else:
+                self.send_error(400, 'setspeedturn2 needs robot, speed and turn')
+        elif pf[-1] == 'hb':
+            qu = parse_qs(pr.query) if pr.query else ()
+            if qu and 'robot' in qu:
+                rstat=gateway.heartbeat(qu['robot'][0])
+                if rstat==200:
+                    self.simpleSend('hb')
+                else:
+                    self.send_error(rstat, 'robot %s did not accept the heartbeat' % qu['robot'][0])
+            else:
+                self.send_error(400, 'hb needs robot')
+        elif pf[-1] == 'fleet':
+            self.simpleSend(gateway.getfeed(), 'application/json')
+        elif pf[1]=='shutdown':
+            server.shutdown()
+            self.simpleSend('wibble')
+        else:
+            print('do not understand', pf[-1])
+            self.send_error(404,"I think there may be an error - I only do fleets (%s)" % pf[-1])
+
+    def clientid(self, qu):
+        """
+        returns the id the client sent with the request, or its ip address if it did not send one
+        """
+        return qu['client'][0] if qu and 'client' in qu else self.client_address[0]
+
+    def simpleSend(self, thcontent, ctype='text/html', status=200):
+        bcontent=thcontent.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', ctype+'; charset=utf-8')
+        self.send_header('Content-Length', str(len(bcontent)))
         self.end_headers()
-        self.wfile.write(thcontent.encode('utf-8'))
+        self.wfile.write(bcontent)
 
     def log_message(self, format, *args):
         return
@@ -78,6 +275,24 @@ def findMyIp():
           )
 DEFWEBPORT      = 8088
 DEFPIMOTORLIB   = "/home/pi/gitbits/pimotors"
+DEFFLEETPERIOD  = 1
+DEFJOURNALSIZE  = 1000000
+DEFTELEMETRYPERIOD = 3
+DEFGOVERNORPERIOD  = 5
+DEFLEASETIME    = 2
+DEFRATESLACK    = .75
+DEFUDPPORT      = 8089
+DEFDEADMAN      = .5
+TELEMETRYMAXAGE = .25
+
+mdrive=None
+usens=None
+gateway=None
+journ=None
+governor=None
+arbiter=None
+odo=None
+udpctl=None
 
 if __name__ == '__main__':
     import sys, os, pathlib
@@ -86,43 +301,105 @@ if __name__ == '__main__':
             'The configuration file must be in the current working directory or a directory in $PYTHONPATH')
     clparse.add_argument( "-w", "--webport", type=int, default=DEFWEBPORT,
         help="port used for the webserver, default %d" % DEFWEBPORT)
-    clparse.add_argument( "-a", "--async",  action="store_true", help='run motor control in separate thread')
+    clparse.add_argument( "-a", "--async",  action="store_true", dest='runasync', help='run motor control in separate thread')
     clparse.add_argument( "-p", "--pimotorlib", default=DEFPIMOTORLIB,
         help="pimotors library, default %s" % DEFPIMOTORLIB)
     clparse.add_argument( "-i", "--htmlfolder", default='',
         help="folder contaning html files, default is folder this module loads from")
-    clparse.add_argument('config', help='configuration file to use')
+    clparse.add_argument( "-g", "--gateway", nargs='+', metavar='ID=HOST:PORT',
+        help="run as a gateway to the listed robots instead of controlling motors directly")
+    clparse.add_argument( "-f", "--fleetperiod", type=float, default=DEFFLEETPERIOD,
+        help="interval in seconds between telemetry polls of each robot when running as a gateway, default %3.1f" % DEFFLEETPERIOD)
+    clparse.add_argument( "-j", "--journal",
+        help="record all control and telemetry requests in this file (for use with replay.py)")
+    clparse.add_argument( "--journalsize", type=int, default=DEFJOURNALSIZE,
+        help="size in bytes at which the journal file is rotated, default %d" % DEFJOURNALSIZE)
+    clparse.add_argument( "-l", "--governor", type=float,
+        help="run the load governor, checking temperature and throttling every GOVERNOR seconds, for example %d" % DEFGOVERNORPERIOD)
+    clparse.add_argument( "-e", "--lease", type=float, default=DEFLEASETIME,
+        help="seconds the driving client keeps control after its last command, 0 lets all clients drive at once, default %3.1f" % DEFLEASETIME)
+    clparse.add_argument( "-n", "--rateslack", type=float, default=DEFRATESLACK,
+        help="fraction of the motor tick allowed between commands from one client before they are rejected, default %3.2f" % DEFRATESLACK)
+    clparse.add_argument( "-u", "--udpport", type=int,
+        help="also accept binary motor commands on this udp port (see udpcontrol.py), for example %d" % DEFUDPPORT)
+    clparse.add_argument( "-k", "--deadman", type=float,
+        help="stop the motors if the driver sends no heartbeat (or command) for this many seconds, index.html sends heartbeats "
+             "while driving, other clients must keep sending commands, for example %3.1f" % DEFDEADMAN)
+    clparse.add_argument('config', nargs='?', help='configuration file to use (not used when running as a gateway)')
     args=clparse.parse_args()
+    if args.gateway is None and args.config is None:
+        clparse.error('a configuration file is required unless running as a gateway')
     sys.path.insert(1, args.pimotorlib)
     sys.path.insert(1, os.getcwd())
     pimfold=pathlib.Path(sys.path[0] if args.htmlfolder=='' else args.htmlfolder)
     indexfiles={k:pimfold/v for k,v in indexbase.items()}
-    conf=importlib.import_module(args.config)
     webport = args.webport
-    if hasattr(conf,'motordef'):
+    if not args.gateway is None:
+        import fleet
+        conf=None
+        gateway=fleet.fleetgateway(fleet.parserobots(args.gateway), period=args.fleetperiod)
+    else:
+        conf=importlib.import_module(args.config)
+    if not gateway is None:
+        mdrive=None
+        minf='gateway to robots %s' % ', '.join(gateway.robotids())
+    elif hasattr(conf,'motordef'):
         import motoradds
-        if args.async:
-            mdrive=motoradds.tstub(motordefs=conf.motordef)
+        arbiter=arbitermod.driverarbiter(leasetime=args.lease, mininterval=args.rateslack*motoradds.MOTORTICK,
+                maxhold=motoradds.MAXTRAJECTORYTIME)
+        mparams=motoradds.configparams(conf)
+        if not args.deadman is None:
+            mparams['deadman']=args.deadman
+        if args.runasync:
+            mdrive=motoradds.tstub(motordefs=conf.motordef, **mparams)
             minf='motors in new process from config file %s' % args.config
         else:
-            mdrive=motoradds.tester(motordefs=conf.motordef)
+            mdrive=motoradds.tester(motordefs=conf.motordef, **mparams)
             minf='motors in process from config file %s' % args.config
     else:
        mdrive=None
        minf='no motors found'
-    usens=None
     usinf='no sensors running'
+    if not mdrive is None and hasattr(conf, 'odometry'):
+        import odometry
+        shared=getattr(mdrive, 'wheels', None)     # the speed control's counters, so the pins are only counted once
+        try:
+            wheels=shared or odometry.makewheels(conf.motordef, motors=getattr(mdrive, 'motors', None),
+                    direction=mdrive.direction)
+        except ImportError:
+            wheels={}
+        if wheels:
+            odo=odometry.odometer(wheels, closecounters=not shared, **conf.odometry)
+            usinf='odometry from motors %s' % ', '.join(wheels.keys())
+        else:
+            usinf='odometry not available'
+    if not args.governor is None:
+        import governor as governormod
+        governor=governormod.loadgovernor(governorsample, period=args.governor)
+        governor.addlistener(governorchange)
+    if not args.journal is None:
+        import journal
+        journ=journal.journal(args.journal, maxsize=args.journalsize)
     server = ThreadedHTTPServer(('',webport),camhandler)
-    import pistatus
-    camon=pistatus.get_state('camera_on')
+    import pistatus, subprocess
+    try:
+        camon=pistatus.get_state('camera_on')
+        camenabled=camon or pistatus.get_state('camera_enabled')
+    except (OSError, subprocess.CalledProcessError):
+        camon=camenabled=False  # not running on a pi (e.g. with simulated motors)
     if camon:
         camstate='ok'
+    elif camenabled:
+        camstate='off'
     else:
-        camenabled=pistatus.get_state('camera_enabled')
-        if camenabled:
-            camstate='off'
-        else:
-            camstate='na'
+        camstate='na'
+    if not args.udpport is None and not mdrive is None:
+        import udpcontrol
+        udpctl=udpcontrol.udpcontroller(args.udpport, drive=lambda speed, turn: mdrive.setspeeddir(speedf=speed, dirf=turn),
+                arbiter=arbiter, journ=journ)
+        minf+=', udp commands on port %d' % args.udpport
+    if not args.deadman is None and not mdrive is None:
+        minf+=', dead-man stop after %dms' % (args.deadman*1000)
     ips=findMyIp()
     if len(ips)==0:
         print('starting webserver on internal IP only (no external IP addresses found), port %d, %s, %s' % (webport, minf, usinf))
@@ -135,8 +412,18 @@ if __name__ == '__main__':
         print('webserver shut down')
     except KeyboardInterrupt:
         server.socket.close()
+    if not gateway is None:
+        gateway.close()
+    if not journ is None:
+        journ.close()
+    if not governor is None:
+        governor.close()
+    if not odo is None:
+        odo.close()
+    if not udpctl is None:
+        udpctl.close()
     if not mdrive is None:
-        if args.async:
+        if args.runasync:
             pstats=mdrive.getProcessStats()
             idlep=pstats['idletime']/pstats['elapsed']*100
             cpup=pstats['cputime']/pstats['elapsed']*100
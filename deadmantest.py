@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+"""
+Measures how long the robot takes to stop when the driver's connection is lost, using simulated motors (fakemotors).
+
+The motors are driven with heartbeats sent at the rate the web page uses, then the heartbeats stop (at a random point between
+two heartbeats, as a real connection would drop) and the time until the motor outputs are cut and until the wheels have stopped
+turning is measured. This is repeated a number of times, with the motors in process and in the (simulated) motor process.
+
+    python3 deadmantest.py -k .5 trike-config
+"""
+import argparse, importlib, os, random, sys, time
+
+DEFDEADMAN      = .5
+DEFTRIALS       = 10
+
+def trial(mdrive, motors, hbms, speed=600, runfor=1):
+    """
+    drives for runfor seconds with heartbeats, then stops the heartbeats and waits for the motors to stop, returns a tuple of
+    seconds from the connection loss to the outputs being cut and to the wheels stopping
+    """
+    mdrive.setspeeddir(speedf=speed, dirf=0)
+    started=time.monotonic()
+    while time.monotonic()-started < runfor:
+        time.sleep(hbms/1000)
+        mdrive.heartbeat()
+    time.sleep(random.random()*hbms/1000)
+    lost=time.monotonic()
+    cut=None
+    while True:
+        now=time.monotonic()
+        if cut is None and all(m.dc==0 for m in motors.values()):
+            cut=now-lost
+        if not cut is None and all(abs(m.getrpm()) < 1 for m in motors.values()):
+            return cut, now-lost
+        if now-lost > 10:
+            raise RuntimeError('motors did not stop')
+        time.sleep(.001)
+
+def runtrials(mdrive, motors, hbms, trials):
+    results=[trial(mdrive, motors, hbms) for i in range(trials)]
+    cuts=[r[0]*1000 for r in results]
+    stops=[r[1]*1000 for r in results]
+    return {'cutmean': sum(cuts)/len(cuts), 'cutmax': max(cuts), 'stopmean': sum(stops)/len(stops), 'stopmax': max(stops)}
+
+if __name__ == '__main__':
+    clparse = argparse.ArgumentParser(description='measures the time from losing the connection to the motors stopping, '
+            'using simulated motors.')
+    clparse.add_argument( "-k", "--deadman", type=float, default=DEFDEADMAN,
+        help="dead-man timeout in seconds, default %3.1f" % DEFDEADMAN)
+    clparse.add_argument( "-n", "--trials", type=int, default=DEFTRIALS, help="number of trials, default %d" % DEFTRIALS)
+    clparse.add_argument('config', help='configuration file to use')
+    args=clparse.parse_args()
+    sys.path.insert(1, 'fakemotors')
+    sys.path.insert(1, os.getcwd())
+    conf=importlib.import_module(args.config)
+    import motoradds
+    mparams=motoradds.configparams(conf)
+    mparams['deadman']=args.deadman
+    hbms=motoradds.heartbeatms(args.deadman)
+    print('dead-man timeout %dms, heartbeat every %dms, %d trials each' % (args.deadman*1000, hbms, args.trials))
+    for desc, mclass in (('in process', motoradds.tester), ('motor process', motoradds.tstub)):
+        mdrive=mclass(motordefs=conf.motordef, printlog=False, **mparams)
+        motors=mdrive.motors if mclass is motoradds.tester else mdrive.wrapped.motors    # fakemotors runs the motor process in a thread
+        try:
+            res=runtrials(mdrive, motors, hbms, args.trials)
+        finally:
+            mdrive.close()
+        print('%-14s connection lost to outputs cut mean %5.1fms max %5.1fms, to wheels stopped mean %5.1fms max %5.1fms' % (
+                desc, res['cutmean'], res['cutmax'], res['stopmean'], res['stopmax']))
@@ -8,3 +8,6 @@ motordef=(
     {'dchparams':{'motorno':3},
      'basicmotor':{'name':'right'},},
 )
+
+# maximum change in motor speed per second (full speed forward is 1, full speed backward -1), see motoradds.tester
+ramp={'accel': 2, 'decel': 4}
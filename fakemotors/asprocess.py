@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+"""
+A stand in for the asprocess module from pimotors. Rather than starting a separate process, the wrapped class is run in this
+process, but the watchdog (kwacktimeout / timeoutfunction) behaves in the same way so async mode can be tried without hardware.
+"""
+import importlib, threading, time
+
+class runAsProcess():
+    def __init__(self, wrappedClass, ticktime, procName, kwacktimeout=None, timeoutfunction=None, **kwargs):
+        """
+        wrappedClass   : module.class name of the class to run
+        ticktime       : interval in seconds at which the watchdog is checked
+        procName       : name used in log messages
+        kwacktimeout   : if not None, timeoutfunction is called if there is no call to sendkwac for this many seconds
+        timeoutfunction: name of the method to call on the wrapped class when the watchdog times out
+        **kwargs       : passed to the wrapped class' constructor
+        """
+        modname, clsname=wrappedClass.rsplit('.',1)
+        self.procName=procName
+        self.ticktime=ticktime
+        self.kwacktimeout=kwacktimeout
+        self.timeoutfunction=timeoutfunction
+        self.wrapped=getattr(importlib.import_module(modname), clsname)(**kwargs)
+        self.lock=threading.Lock()
+        self.started=time.perf_counter()
+        self.cpustart=time.process_time()
+        self.ticks=0
+        self.lastkwac=time.monotonic()
+        self.timedout=False
+        self.running=True
+        self.watcher=threading.Thread(target=self._watchdog, name=procName, daemon=True)
+        self.watcher.start()
+
+    def _watchdog(self):
+        while self.running:
+            time.sleep(self.ticktime)
+            self.ticks+=1
+            if not self.kwacktimeout is None and not self.timedout and time.monotonic()-self.lastkwac > self.kwacktimeout:
+                self.timedout=True
+                print('%s: watchdog timeout - calling %s' % (self.procName, self.timeoutfunction))
+                self.runOnProc(self.timeoutfunction, 'a')
+
+    def runOnProc(self, fname, mode, **kwargs):
+        with self.lock:
+            getattr(self.wrapped, fname)(**kwargs)
+
+    def sendkwac(self):
+        self.lastkwac=time.monotonic()
+        self.timedout=False
+
+    def getProcessStats(self):
+        elapsed=time.perf_counter()-self.started
+        cputime=time.process_time()-self.cpustart
+        return {'elapsed': elapsed, 'cputime': cputime, 'idletime': max(elapsed-cputime, 0), 'ticks': self.ticks}
+
+    def stubend(self):
+        self.running=False
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+"""
+A stand in for the motorset module from pimotors that drives simulated motors instead of real hardware.
+
+This lets the web server, gateway and tools in this repository run on any machine (no pigpio, no motor HATs), for example to run
+several local robot instances:
+
+    python3 camservermotorsu4vl.py -p fakemotors -w 8091 trike-config
+
+Any existing config file can be used, the parameters for each motor are merged together and the simulated motor picks out
+the ones it understands (name, and if present the senseparams that make it look like a motor with a rotation sensor).
+"""
+import math, time, threading
+
+class simmotor():
+    """
+    A very simple model of a dc motor driven by pwm. The rpm follows the duty cycle with a first order lag, and there is
+    a dead band at low duty cycles where the motor does not turn at all. Above the dead band the rpm rises along a curve that
+    flattens off towards full speed (set curve to 0 for a straight line).
+
+    Lower pwm frequencies (see setFrequency) give the motor a harder kick each cycle, so the dead band shrinks (the motor runs
+    more slowly before stalling) but some top speed is lost, much like a real motor.
+
+    Every call that changes the output is counted in writes, so the number of (real) hardware writes that would have been
+    made can be checked.
+
+    supply can be changed at any time to mimic a flattening battery or a heavier load (0.8 gives 80% of the expected rpm).
+
+    clock can be replaced by any function that returns the time in seconds, so the model can be run faster than real time.
+    """
+    def __init__(self, name, maxrpm=250, maxdc=255, deadband=.12, tau=.15, curve=1.5, frequency=100, pulsesperrev=None,
+                edges='both', pinss=None, invert=False, **kwargs):
+        """
+        name        : name of the motor
+        maxrpm      : rpm at full duty cycle
+        maxdc       : the maximum value for the duty cycle
+        deadband    : fraction of maxdc below which the motor does not turn (at 100Hz and above)
+        tau         : time constant (in seconds) of the motor's response
+        curve       : how much the rpm curve flattens off towards full speed, 0 for a straight line
+        frequency   : initial pwm frequency in Hz
+        pulsesperrev: if present the motor simulates a rotation sensor with this many pulses per revolution per pin
+        edges       : 'both' if both edges of each pulse are counted
+        pinss       : the sensor pins (used to count the number of pins used)
+        invert      : ignored - a simulated motor always turns the right way
+        **kwargs    : allows other arbitrary keyword parameters to be ignored
+        """
+        self.name=name
+        self.maxrpm=maxrpm
+        self.maxdc=maxdc
+        self.basedeadband=deadband
+        self.deadband=deadband
+        self.topspeed=maxrpm
+        self.tau=tau
+        self.curve=curve
+        if pulsesperrev is None:
+            self.edgesperrev=None
+        else:
+            self.edgesperrev=pulsesperrev*(2 if edges=='both' else 1)*(1 if pinss is None else len(pinss))
+        self.supply=1
+        self.dc=0
+        self.rpm=0
+        self.revs=0
+        self.writes=0
+        self.clock=time.monotonic
+        self.lastupdate=self.clock()
+        self.lock=threading.Lock()
+        self.Hz=None
+        self.setFrequency(frequency)
+
+    def _update(self):
+        """
+        advances the model to the current time
+        """
+        now=self.clock()
+        dt=now-self.lastupdate
+        self.lastupdate=now
+        if dt > 0:
+            steady=self.steadyrpm(self.dc)
+            newrpm=steady+(self.rpm-steady)*math.exp(-dt/self.tau)
+            self.revs+=(self.rpm+newrpm)/2*dt/60
+            self.rpm=newrpm
+
+    def steadyrpm(self, dc):
+        """
+        the rpm the motor will settle at with the given duty cycle
+        """
+        frac=abs(dc)/self.maxdc
+        if frac <= self.deadband:
+            return 0
+        x=(frac-self.deadband)/(1-self.deadband)
+        if self.curve > 0:
+            x=(1-math.exp(-self.curve*x))/(1-math.exp(-self.curve))
+        rpm=self.topspeed*self.supply*x
+        return -rpm if dc < 0 else rpm
+
+    def setFrequency(self, frequency):
+        """
+        changes the pwm frequency in Hz, which changes the dead band and the top speed (see the class description)
+        """
+        if frequency == self.Hz:
+            return
+        with self.lock:
+            self._update()
+            self.Hz=frequency
+            ffrac=min(frequency, 100)/100
+            self.deadband=self.basedeadband*(.4+.6*ffrac)
+            self.topspeed=self.maxrpm*(.9+.1*ffrac)
+
+    def DC(self, dutycycle):
+        """
+        sets the duty cycle, in the range -maxdc to +maxdc
+        """
+        if not -self.maxdc <= dutycycle <= self.maxdc:
+            raise ValueError('motor %s: %s is not valid - should be in range (-%d, +%d)' % (
+                str(self.name), str(dutycycle), self.maxdc, self.maxdc))
+        with self.lock:
+            self._update()
+            self.dc=dutycycle
+            self.writes+=1
+
+    def maxDC(self):
+        return self.maxdc
+
+    def speedLimits(self):
+        """
+        returns None if the motor has no rotation sensor, otherwise (max reverse, min reverse, min forward, max forward) rpm
+        """
+        if self.edgesperrev is None:
+            return None
+        minrpm=self.maxrpm*.05
+        return (-self.maxrpm, -minrpm, minrpm, self.maxrpm)
+
+    def speed(self, speed):
+        """
+        sets the duty cycle that will (eventually) give the requested rpm
+        """
+        aspeed=min(abs(speed), self.topspeed)
+        if aspeed == 0:
+            dc=0
+        else:
+            x=aspeed/self.topspeed
+            if self.curve > 0:
+                x=-math.log(1-x*(1-math.exp(-self.curve)))/self.curve
+            dc=self.maxdc*(self.deadband+(1-self.deadband)*x)
+        self.DC(-dc if speed < 0 else dc)
+
+    def stop(self):
+        self.DC(0)
+
+    def getrpm(self):
+        """
+        returns the current (simulated) rpm
+        """
+        with self.lock:
+            self._update()
+            return self.rpm
+
+    def edges(self):
+        """
+        returns the signed count of sensor edges since the motor was created (0 if the motor has no sensor)
+        """
+        if self.edgesperrev is None:
+            return 0
+        with self.lock:
+            self._update()
+            return int(self.revs*self.edgesperrev)
+
+class motorset():
+    """
+    Sets up a simulated motor for each entry in motordefs, mimicking the motors attribute and the basic methods of
+    pimotors' motorset.
+    """
+    def __init__(self, motordefs, **kwargs):
+        self.motors={}
+        for mdef in motordefs:
+            mparams={}
+            for mpart in mdef.values():
+                mparams.update(mpart)
+            m=simmotor(**mparams)
+            self.motors[m.name]=m
+        print('simulated motorset set up motors %s' % ','.join(self.motors.keys()))
+
+    def stopMotor(self, mlist=None):
+        for m in self._delist(mlist):
+            m.stop()
+
+    def close(self):
+        self.stopMotor()
+        print('simulated motorset closing down')
+        self.motors={}
+
+    def _delist(self, units):
+        if units is None:
+            return tuple(self.motors.values())
+        elif isinstance(units,str):
+            return (self.motors[units],)
+        else:
+            return [self.motors[m] for m in units]
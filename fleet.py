@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""
+Support for running camservermotorsu4vl.py as a gateway in front of several robots.
+
+The gateway keeps a small pool of persistent (HTTP/1.1 keep alive) connections to each robot's web server, passes motor commands
+to the robot they are addressed to, and polls each robot's telemetry so a single batched feed for the whole fleet can be served
+to any number of browsers without each of them connecting to every robot.
+"""
+import http.client, json, queue, threading, time
+
+DEFROBOTPORT = 8088
+GATEWAYCLIENT = 'gateway'   # client id the gateway uses with the robots, its telemetry polls do not feed the motor watchdog
+
+def parserobots(robotspecs):
+    """
+    converts a list of robot definitions, each of the form id=host[:port], to a list of (id, host, port) tuples
+    """
+    robots=[]
+    for rspec in robotspecs:
+        if '=' in rspec:
+            rid, addr = rspec.split('=',1)
+        else:
+            rid, addr = rspec, rspec
+        if ':' in addr:
+            host, port = addr.rsplit(':',1)
+            port=int(port)
+        else:
+            host, port = addr, DEFROBOTPORT
+        robots.append((rid, host, port))
+    return robots
+
+class robotlink():
+    """
+    A pool of persistent connections to a single robot's web server
+    """
+    def __init__(self, robotid, host, port, poolsize=2, timeout=2):
+        """
+        robotid : the id used to identify this robot
+        host    : host name or ip address of the robot
+        port    : port the robot's web server is using
+        poolsize: maximum number of idle connections kept open
+        timeout : timeout in seconds for each request
+        """
+        self.robotid=robotid
+        self.host=host
+        self.port=port
+        self.timeout=timeout
+        self.pool=queue.LifoQueue(maxsize=poolsize)
+        self.requests=0
+        self.connects=0
+        self.errors=0
+
+    def get(self, path):
+        """
+        makes a GET request on a pooled connection, returns a tuple of (status code, response body as bytes)
+
+        A connection that has been dropped by the robot is retried once on a fresh connection.
+        """
+        for attempt in range(2):
+            try:
+                conn=self.pool.get_nowait()
+                reused=True
+            except queue.Empty:
+                conn=http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self.connects+=1
+                reused=False
+            try:
+                conn.request('GET', path)
+                resp=conn.getresponse()
+                body=resp.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if reused and attempt==0:
+                    continue
+                self.errors+=1
+                raise
+            self.requests+=1
+            if resp.will_close:
+                conn.close()
+            else:
+                try:
+                    self.pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return resp.status, body
+
+    def getstats(self):
+        return {'requests': self.requests, 'connects': self.connects, 'errors': self.errors}
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+class fleetgateway():
+    """
+    Routes commands to individual robots and aggregates their telemetry into a single feed.
+    """
+    def __init__(self, robots, period=1, poolsize=2):
+        """
+        robots  : list of (id, host, port) tuples (see parserobots)
+        period  : interval in seconds between telemetry polls of each robot
+        poolsize: maximum number of idle connections kept open to each robot
+        """
+        self.period=period
+        self.links={rid: robotlink(rid, host, port, poolsize=poolsize) for rid, host, port in robots}
+        self.lock=threading.Lock()
+        self.robotstates={rid: {'ok': False, 'tstamp': None, 'telemetry': None} for rid in self.links.keys()}
+        self.feedcache=None
+        self.running=True
+        self.pollers=[threading.Thread(target=self._poller, args=(rlink,), name='poll-%s' % rid, daemon=True)
+                for rid, rlink in self.links.items()]
+        for t in self.pollers:
+            t.start()
+
+    def _poller(self, rlink):
+        """
+        runs in a thread for each robot, fetching its telemetry at regular intervals
+        """
+        while self.running:
+            started=time.monotonic()
+            try:
+                status, body=rlink.get('/telemetry?client=%s' % GATEWAYCLIENT)
+                newstate={'ok': status==200, 'tstamp': time.time(),
+                          'telemetry': json.loads(body.decode('utf-8')) if status==200 else None}
+            except (http.client.HTTPException, OSError, ValueError) as e:
+                newstate={'ok': False, 'tstamp': time.time(), 'telemetry': None, 'error': str(e)}
+            with self.lock:
+                self.robotstates[rlink.robotid]=newstate
+                self.feedcache=None
+            time.sleep(max(self.period-(time.monotonic()-started), .05))
+
+    def robotids(self):
+        return list(self.links.keys())
+
+    def setspeedturn(self, robotid, speed, turn):
+        """
+        passes a speed / turn command to the given robot, returns the http status from the robot (or 404 if the robot is unknown,
+        502 if the robot could not be contacted)
+        """
+        if not robotid in self.links:
+            return 404
+        try:
+            status, body=self.links[robotid].get('/setspeedturn2?speed=%d&turn=%d&client=%s' % (speed, turn, GATEWAYCLIENT))
+        except (http.client.HTTPException, OSError):
+            return 502
+        return status
+
+    def heartbeat(self, robotid):
+        """
+        passes a dead-man heartbeat to the given robot, returns the http status as for setspeedturn
+        """
+        if not robotid in self.links:
+            return 404
+        try:
+            status, body=self.links[robotid].get('/hb?client=%s' % GATEWAYCLIENT)
+        except (http.client.HTTPException, OSError):
+            return 502
+        return status
+
+    def getfeed(self):
+        """
+        returns the latest telemetry of all robots as a json string, the string is only rebuilt when new telemetry has arrived
+        """
+        with self.lock:
+            if self.feedcache is None:
+                self.feedcache=json.dumps({'tstamp': time.time(), 'robots': self.robotstates,
+                        'links': {rid: rlink.getstats() for rid, rlink in self.links.items()}})
+            return self.feedcache
+
+    def close(self):
+        self.running=False
+        for rlink in self.links.values():
+            rlink.close()
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+A simple governor that watches the cpu temperature and the pi's throttling state and steps down the non-essential load in
+stages when the pi is getting too hot or the supply voltage is too low.
+
+The governor never touches motor commands; it only slows down the things that can safely be slowed down:
+    level 0: normal running
+    level 1: telemetry polling from the web page is slowed
+    level 2: as level 1, and the ultrasonic sensors are triggered less often
+    level 3: as level 2, and the web page switches from the video stream to occasional still frames
+
+The sensor period is only applied when the server is running the ultrasonic sensors (usSensors.setperiod). The server does not
+start them at present, so for now level 2 changes nothing over level 1.
+"""
+import threading, time
+
+defstages=(
+    {'telemetryperiod': 3,  'sensorperiod': .5, 'framerate': None},
+    {'telemetryperiod': 6,  'sensorperiod': .5, 'framerate': None},
+    {'telemetryperiod': 10, 'sensorperiod': 1.5, 'framerate': None},
+    {'telemetryperiod': 15, 'sensorperiod': 3, 'framerate': 1},
+)
+
+# bits in the value returned by vcgencmd get_throttled (see pistatus)
+UNDERVOLT   = 1
+FREQCAPPED  = 2
+THROTTLED   = 4
+
+class loadgovernor():
+    def __init__(self, sampler, period=5, templimits=(70, 75, 80), hysteresis=3, stages=defstages):
+        """
+        Sets up the governor and starts a thread that checks the state every period seconds.
+
+        sampler   : a function returning a tuple of (cpu temperature or None, throttled bits or None)
+        period    : interval in seconds between samples
+        templimits: temperatures at which the governor moves up to levels 1, 2 and 3
+        hysteresis: the temperature has to drop this many degrees below a limit before the level drops back
+        stages    : a tuple with the settings for each level (see defstages)
+        """
+        assert len(templimits)==len(stages)-1, 'loadgovernor needs one temperature limit per stage above 0'
+        self.sampler=sampler
+        self.period=period
+        self.templimits=templimits
+        self.hysteresis=hysteresis
+        self.stages=stages
+        self.level=0
+        self.lasttemp=None
+        self.lastthrottled=None
+        self.changes=0
+        self.listeners=[]
+        self.running=True
+        self.checker=threading.Thread(target=self._checker, name='governor', daemon=True)
+        self.checker.start()
+
+    def addlistener(self, func):
+        """
+        func will be called with the new settings (a dict from stages) each time the level changes
+        """
+        self.listeners.append(func)
+
+    def _checker(self):
+        while self.running:
+            self.check()
+            time.sleep(self.period)
+
+    def check(self):
+        """
+        takes a sample and updates the level, calling the listeners if it has changed
+        """
+        temp, throttled = self.sampler()
+        self.lasttemp=temp
+        self.lastthrottled=throttled
+        newlevel=self.calclevel(temp, throttled)
+        if newlevel != self.level:
+            print('governor: level %d -> %d, cpu temp %s, throttled %s' % (self.level, newlevel,
+                    '?' if temp is None else '%3.1f' % temp, '?' if throttled is None else hex(throttled)))
+            self.level=newlevel
+            self.changes+=1
+            for func in self.listeners:
+                func(self.stages[newlevel])
+
+    def calclevel(self, temp, throttled):
+        """
+        works out the level needed for the given temperature and throttling state
+        """
+        templevel=0
+        if not temp is None:
+            for i, limit in enumerate(self.templimits):
+                if temp >= limit or (i < self.level and temp > limit-self.hysteresis):
+                    templevel=i+1
+        thlevel=0
+        if not throttled is None:
+            if throttled & UNDERVOLT:
+                thlevel=3
+            elif throttled & THROTTLED:
+                thlevel=2
+            elif throttled & FREQCAPPED:
+                thlevel=1
+        return min(max(templevel, thlevel), len(self.stages)-1)
+
+    def settings(self):
+        return self.stages[self.level]
+
+    def getstate(self):
+        """
+        returns a dict with the current level and settings and the last sample, suitable for telemetry
+        """
+        return {'level': self.level, 'cputemp': self.lasttemp, 'throttled': self.lastthrottled, 'changes': self.changes,
+                'settings': self.stages[self.level]}
+
+    def close(self):
+        self.running=False
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""
+A simple append only journal of the requests made to the robot's web server, so that a session can be replayed later
+(see replay.py).
+
+Each request is stored as a fixed size binary record (timestamp, kind and 2 integer values), giving 13 bytes per request.
+When the file reaches maxsize it is renamed and a new file started, much like logging.handlers.RotatingFileHandler, so
+with the defaults a journal will never use more than 5MB.
+
+A trajectory is stored as a 'trajectory' record followed by one 'trajectorypoint' record per point (see recordtrajectory),
+these are always written together in the same file.
+"""
+import os, struct, threading, time
+
+recformat = struct.Struct('<dBhh')  # timestamp, kind, value1, value2
+
+kinds = {
+    1: 'setspeedturn2',   # value1 is speed, value2 is turn
+    2: 'cputemp',
+    3: 'sensors',
+    4: 'telemetry',
+    5: 'trajectory',        # value1 is the number of trajectorypoint records that follow
+    6: 'trajectorypoint',   # the timestamp is the point's time offset, value1 and value2 are left and right (-1000 to +1000)
+    7: 'canceltrajectory',
+}
+kindcodes = {v: k for k, v in kinds.items()}
+
+def journalfiles(filename, keep):
+    """
+    returns the list of existing files for a journal, oldest first
+    """
+    allfiles=[filename]+['%s.%d' % (filename, i) for i in range(1, keep)]
+    return [f for f in reversed(allfiles) if os.path.isfile(f)]
+
+def readjournal(filenames):
+    """
+    a generator that yields a tuple (timestamp, kind, value1, value2) for each record in the given files, the kind is
+    the name of the request (see kinds)
+    """
+    for fn in filenames:
+        with open(fn, 'rb') as jf:
+            while True:
+                rec=jf.read(recformat.size)
+                if len(rec) < recformat.size:
+                    break
+                tstamp, kind, v1, v2 = recformat.unpack(rec)
+                yield tstamp, kinds.get(kind, str(kind)), v1, v2
+
+class journal():
+    def __init__(self, filename, maxsize=1000000, keep=5):
+        """
+        Opens (or continues) a journal.
+
+        filename: the name of the current journal file, older files have .1, .2 etc. appended
+        maxsize : size in bytes at which the current file is rotated
+        keep    : total number of files kept including the current file
+        """
+        self.filename=filename
+        self.maxsize=maxsize
+        self.keep=keep
+        self.lock=threading.Lock()
+        self.jfile=open(self.filename, 'ab', buffering=0)
+        self.size=self.jfile.tell()
+        self.records=0
+
+    def record(self, kind, value1=0, value2=0):
+        """
+        appends a single record to the journal, kind is the name of the request (see kinds)
+        """
+        self._write(recformat.pack(time.time(), kindcodes[kind], max(-32768, min(32767, value1)), max(-32768, min(32767, value2))), 1)
+
+    def recordtrajectory(self, steps):
+        """
+        appends a trajectory as returned by motoradds.parsetrajectory (a list of (time offset, left, right) tuples)
+        """
+        recs=[recformat.pack(time.time(), kindcodes['trajectory'], len(steps), 0)]
+        ptcode=kindcodes['trajectorypoint']
+        for toff, left, right in steps:
+            recs.append(recformat.pack(toff, ptcode, round(left*1000), round(right*1000)))
+        self._write(b''.join(recs), len(recs))
+
+    def _write(self, recs, count):
+        with self.lock:
+            if self.jfile is None:
+                return
+            if self.size+len(recs) > self.maxsize:
+                self._rotate()
+            self.jfile.write(recs)
+            self.size+=len(recs)
+            self.records+=count
+
+    def _rotate(self):
+        self.jfile.close()
+        for i in range(self.keep-1, 0, -1):
+            src=self.filename if i==1 else '%s.%d' % (self.filename, i-1)
+            if os.path.isfile(src):
+                os.replace(src, '%s.%d' % (self.filename, i))
+        self.jfile=open(self.filename, 'ab', buffering=0)
+        self.size=0
+
+    def close(self):
+        with self.lock:
+            if not self.jfile is None:
+                self.jfile.close()
+                self.jfile=None
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+"""
+Drives the motors in a configuration file (simulated motors by default) steadily through motoradds.tester and reports the memory
+used: the process RSS, the growth in python objects, and the rate the driving code allocates memory. The Pi Zero shares its 512MB
+with UV4L, so the figures should stay flat however long the robot is driven.
+
+Allocations are measured in a separate (shorter) phase with tracemalloc running, as tracing slows everything down. They are
+counted across all threads, so the work done by the motor tick thread (ramping and closed loop speed control) is included as
+well as the commands themselves. tracemalloc only gives the current and peak traced memory, so a sampler thread collects the
+peak above the starting level every few milliseconds: memory allocated and freed again within one sample is counted once, so
+the figure is a lower bound on the churn. The same is measured for a couple of seconds with no commands (the motor tick still
+runs) first, which also shows the floor of the measurement itself.
+
+For example, 60 seconds of driving at 10 commands per second:
+
+    python3 membench.py -p fakemotors -d 60 trike-config
+"""
+import argparse, gc, importlib, math, os, resource, sys, threading, time, tracemalloc
+
+DEFPIMOTORLIB   = "fakemotors"
+DEFRATE         = 10
+DEFDURATION     = 30
+DEFTRACED       = 5
+DEFSAMPLEMS     = 10
+
+def memkb():
+    """
+    returns a tuple of the current and peak resident set size of this process in KB
+    """
+    try:
+        with open('/proc/self/status') as sfile:
+            vals={l.split(':')[0]: int(l.split()[1]) for l in sfile if l.startswith(('VmRSS', 'VmHWM'))}
+        return vals['VmRSS'], vals['VmHWM']
+    except (OSError, KeyError):
+        peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak, peak
+
+def drivecommand(t):
+    """
+    returns the speed and turn for time t - a steady cruise with gentle weaving and the occasional stop
+    """
+    if t % 20 > 18:
+        return 0, 0
+    return int(500+300*math.sin(t/3)), int(400*math.sin(t))
+
+def drive(mdrive, duration, rate):
+    """
+    sends commands to mdrive at rate per second for duration seconds, returns the number sent
+    """
+    interval=1/rate
+    started=time.monotonic()
+    nextcmd=started
+    sent=0
+    while True:
+        now=time.monotonic()
+        if now-started >= duration:
+            return sent
+        speed, turn = drivecommand(now-started)
+        mdrive.setspeeddir(speedf=speed, dirf=turn)
+        sent+=1
+        nextcmd+=interval
+        wait=nextcmd-time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+class allocsampler():
+    """
+    Runs a thread that adds up the traced memory allocated in each interval (the peak above the level at the start of the
+    interval) and the memory kept, while tracemalloc is running.
+    """
+    def __init__(self, interval=DEFSAMPLEMS/1000, calibration=200):
+        """
+        interval   : seconds between samples
+        calibration: number of samples taken straight away to measure the memory the sampling itself allocates, which is
+                     taken off the results
+        """
+        self.interval=interval
+        self.churn=0
+        self.samples=0
+        self.running=True
+        self.start=tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        before=self.start
+        for i in range(calibration):
+            before=self._sample(before)
+        self.overhead=self.churn/calibration if calibration > 0 else 0
+        self.churn=0
+        self.samples=0
+        self.start=before
+        self.sampler=threading.Thread(target=self._sampler, name='allocsampler', daemon=True)
+        self.sampler.start()
+
+    def _sample(self, before):
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self.churn+=peak-before
+        self.samples+=1
+        return current
+
+    def _sampler(self):
+        before=self.start
+        while self.running:
+            time.sleep(self.interval)
+            before=self._sample(before)
+
+    def stop(self):
+        """
+        stops the sampler, returns a tuple of the total memory allocated (less the sampler's own) and the memory kept since it
+        started
+        """
+        self.running=False
+        self.sampler.join()
+        current, peak = tracemalloc.get_traced_memory()
+        return max(self.churn+peak-current-self.overhead*self.samples, 0), current-self.start
+
+def benchmark(mdrive, duration=DEFDURATION, rate=DEFRATE, traced=DEFTRACED, samplems=DEFSAMPLEMS):
+    """
+    drives mdrive for duration seconds then for traced seconds with tracemalloc running, returns a dict of results
+    """
+    drive(mdrive, min(2, duration), rate)     # warm up so one off allocations are not counted
+    gc.collect()
+    rssstart, _ = memkb()
+    objsstart=len(gc.get_objects())
+    blocksstart=sys.getallocatedblocks()
+    gcstart=gc.get_stats()[0]['collections']
+    started=time.monotonic()
+    sent=drive(mdrive, duration, rate)
+    elapsed=time.monotonic()-started
+    gc.collect()
+    rssend, rsspeak = memkb()
+    res={
+        'commands'  : sent,
+        'elapsed'   : elapsed,
+        'rssstart'  : rssstart,
+        'rssend'    : rssend,
+        'rsspeak'   : rsspeak,
+        'objsgrowth': len(gc.get_objects())-objsstart,
+        'blocksgrowth': sys.getallocatedblocks()-blocksstart,
+        'gen0rate'  : (gc.get_stats()[0]['collections']-gcstart)/elapsed,
+    }
+    if traced > 0:
+        tracemalloc.start()
+        sampler=allocsampler(samplems/1000)
+        idletime=min(traced, 2)
+        time.sleep(idletime)
+        res['idlerate']=sampler.stop()[0]/idletime
+        sampler=allocsampler(samplems/1000)
+        started=time.monotonic()
+        tsent=drive(mdrive, traced, rate)
+        telapsed=time.monotonic()-started
+        churn, kept = sampler.stop()
+        tracemalloc.stop()
+        res['allocrate']=churn/telapsed
+        res['allocpercommand']=churn/tsent if tsent > 0 else 0
+        res['keptpercommand']=kept/tsent if tsent > 0 else 0
+    return res
+
+if __name__ == '__main__':
+    clparse = argparse.ArgumentParser(description='drives the motors specified in the configuration file (simulated motors by '
+            'default) at a steady rate and reports the memory used.')
+    clparse.add_argument( "-p", "--pimotorlib", default=DEFPIMOTORLIB,
+        help="pimotors library, default %s (simulated motors)" % DEFPIMOTORLIB)
+    clparse.add_argument( "-r", "--rate", type=float, default=DEFRATE, help="commands per second, default %d" % DEFRATE)
+    clparse.add_argument( "-d", "--duration", type=float, default=DEFDURATION,
+        help="seconds of driving to measure RSS over, default %d" % DEFDURATION)
+    clparse.add_argument( "-t", "--traced", type=float, default=DEFTRACED,
+        help="seconds of driving to measure allocations over (0 to skip), default %d" % DEFTRACED)
+    clparse.add_argument( "-s", "--samplems", type=float, default=DEFSAMPLEMS,
+        help="milliseconds between samples of the allocated memory, default %d" % DEFSAMPLEMS)
+    clparse.add_argument('config', help='configuration file to use')
+    args=clparse.parse_args()
+    sys.path.insert(1, args.pimotorlib)
+    sys.path.insert(1, os.getcwd())
+    conf=importlib.import_module(args.config)
+    import motoradds
+    mparams=motoradds.configparams(conf)
+    mdrive=motoradds.tester(motordefs=conf.motordef, printlog=False, **mparams)
+    try:
+        res=benchmark(mdrive, duration=args.duration, rate=args.rate, traced=args.traced, samplems=args.samplems)
+    except KeyboardInterrupt:
+        res=None
+    mdrive.close()
+    if not res is None:
+        print('%d commands in %4.1fs (%4.1f per second)' % (res['commands'], res['elapsed'], res['commands']/res['elapsed']))
+        print('RSS %dKB at start, %dKB at end (%+dKB), peak %dKB' % (res['rssstart'], res['rssend'],
+                res['rssend']-res['rssstart'], res['rsspeak']))
+        print('growth while driving: %d python objects, %d memory blocks, %4.2f gen0 collections per second' % (
+                res['objsgrowth'], res['blocksgrowth'], res['gen0rate']))
+        if 'allocrate' in res:
+            print('allocations with no commands (all threads): %6.0f bytes per second' % res['idlerate'])
+            print('allocations while driving (all threads): %6.0f bytes per second, %5.0f bytes per command, %4.1f bytes kept per '
+                    'command' % (
+                    res['allocrate'], res['allocpercommand'], res['keptpercommand']))
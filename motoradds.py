@@ -1,32 +1,301 @@
 #!/usr/bin/python3
 
+import math, threading, time
 import motorset
+import odometry
+
+NULLSPEED   = 150   # speed requests smaller than this are treated as 0
+NULLTURN    = 150   # turn requests smaller than this are treated as 0
+MOTORTICK   = .1    # interval in seconds of the motor process tick, commands more frequent than this are wasted
+
+def mixspeeddir(speedf, dirf, nullspeed=NULLSPEED, nullturn=NULLTURN):
+    """
+    converts speed and turn values (see tester.setspeeddir) to abstract speeds for the left and right motors
+
+    returns a tuple (left, right), each in the range -1 (full speed backwards) to +1 (full speed forwards)
+    """
+    speedl=0 if abs(speedf) < nullspeed else (abs(speedf)-nullspeed)/(1000-nullspeed)
+    if speedf < 0:
+        speedl=-speedl
+    speedr=speedl
+    # speedr/l now in range -1 to +1
+#    print('normed speed: %3.2f' % speedl)
+    if abs(dirf) > nullturn:
+        spad=(abs(dirf)-nullturn)/(1000-nullturn)
+        if dirf < 0:
+            spad=-spad
+        # spad now in range -1 to +1
+        speedl+=spad
+        speedr-=spad
+        combo=abs(speedf)+abs(dirf)
+        if combo > 1000:
+            scale=1000/combo
+            speedl*=scale
+            speedr*=scale
+    # requests outside -1000 to +1000 would give speeds the motors cannot take
+    return max(-1, min(1, speedl)), max(-1, min(1, speedr))
+
+MAXTRAJECTORY = 2000    # maximum number of points in a trajectory
+MAXTRAJECTORYTIME = 300 # maximum time offset (in seconds) of any point in a trajectory
+
+CONFIGPARAMS = ('ramp', 'speedcontrol')     # entries in a config file that are passed to tester
+HEARTBEATS   = 4        # heartbeats clients are asked to send in each dead-man timeout
+
+def heartbeatms(deadman):
+    """
+    returns the interval in milliseconds that clients should send heartbeats at for a dead-man timeout, None if no timeout
+    """
+    return None if deadman is None else max(int(deadman*1000/HEARTBEATS), 20)
+
+def configparams(conf):
+    """
+    returns a dict of the keyword parameters for tester (or tstub) found in a config module
+    """
+    return {pname: getattr(conf, pname) for pname in CONFIGPARAMS if hasattr(conf, pname)}
+
+def parsetrajectory(points, nullspeed=NULLSPEED, nullturn=NULLTURN):
+    """
+    checks a trajectory and converts it to a list of (time offset, left, right) tuples with left and right in the range -1 to +1.
+
+    points: a list of points in time order, each point is either:
+                [time offset, speed, turn] with speed and turn as for setspeeddir, or
+                [time offset, {'left': left speed, 'right': right speed}] with each speed from -1000 to +1000
+            time offsets are in seconds from the start of the trajectory (at most MAXTRAJECTORYTIME). The values of each point
+            are used from its time offset until the time of the next point, so the last point (normally a stop) marks the end of
+            the trajectory.
+
+    raises ValueError if there is anything wrong with the trajectory
+    """
+    if not isinstance(points, (list, tuple)) or not 0 < len(points) <= MAXTRAJECTORY:
+        raise ValueError('a trajectory must be a list of 1 to %d points' % MAXTRAJECTORY)
+    steps=[]
+    lastt=0
+    for pt in points:
+        if len(pt)==3:
+            toff, speedf, dirf = float(pt[0]), float(pt[1]), float(pt[2])
+            vals=(speedf, dirf)
+        elif len(pt)==2 and isinstance(pt[1], dict):
+            toff=float(pt[0])
+            vals=[float(pt[1].get(mname, 0)) for mname in ('left', 'right')]
+        else:
+            raise ValueError('trajectory point %s not recognised' % str(pt))
+        if not all(math.isfinite(v) for v in vals) or not math.isfinite(toff):
+            raise ValueError('trajectory values must be finite numbers (%s)' % str(pt))
+        if toff > MAXTRAJECTORYTIME:
+            raise ValueError('trajectory times must be at most %d seconds (%s)' % (MAXTRAJECTORYTIME, str(pt)))
+        if len(pt)==3 and not (abs(speedf) <= 1000 and abs(dirf) <= 1000):
+            raise ValueError('trajectory speed and turn must be from -1000 to +1000 (%s)' % str(pt))
+        if len(pt)==3:
+            left, right = mixspeeddir(int(speedf), int(dirf), nullspeed, nullturn)
+        else:
+            left, right = [max(-1000, min(1000, v))/1000 for v in vals]
+        if toff < lastt:
+            raise ValueError('trajectory times must be in order (%s)' % str(pt))
+        lastt=toff
+        steps.append((toff, left, right))
+    return steps
+
+def rampspeed(actual, target, elapsed, ramp):
+    """
+    returns the (abstract) speed reached after elapsed seconds moving from actual towards target within the ramp limits (see
+    tester), a motor changing direction slows to a stop first
+    """
+    if actual*target < 0:
+        tostop=abs(actual)/ramp['decel']
+        if elapsed < tostop:
+            return actual-math.copysign(ramp['decel']*elapsed, actual)
+        actual, elapsed = 0, elapsed-tostop
+    maxstep=ramp['decel' if abs(target) < abs(actual) else 'accel']*elapsed
+    if abs(target-actual) <= maxstep:
+        return target
+    return actual+(maxstep if target > actual else -maxstep)
+
+class motorcontrol():
+    """
+    How the tester drives a single motor: the function called with each new output value and the values used to scale abstract
+    (-1 to +1) speeds to that function's range (smap in speed mode, smax in DC mode).
+    """
+    __slots__=('name', 'sfunc', 'smap', 'smax', 'loop')
+
+    def __init__(self, name, sfunc, smap=None, smax=None, loop=None):
+        self.name=name
+        self.sfunc=sfunc
+        self.smap=smap
+        self.smax=smax
+        self.loop=loop
+
+class speedloop():
+    """
+    Holds one wheel at a requested rpm. The duty cycle is a feed-forward value for the requested rpm, looked up in a speed
+    table, plus a PI correction from the rpm measured by the wheel's rotation sensor.
+
+    The gains work in fractions of maxdc per fraction of maxrpm, so the same values suit most motors.
+    """
+    __slots__=('wheel', 'maxrpm', 'maxdc', 'kp', 'ki', 'table', 'target', 'integral', 'rpm', 'error', 'sqerror', 'errtau')
+
+    def __init__(self, wheel, maxrpm, maxdc, kp=.6, ki=3, table=None, errtau=2):
+        """
+        wheel : an odometry.wheelspeed for the motor
+        maxrpm: rpm of the motor at full speed
+        maxdc : the largest duty cycle the motor accepts
+        kp    : proportional gain
+        ki    : integral gain (per second)
+        table : feed-forward table in the same form as a phatpigpio speed table ((speed, frequency, dutycycle), ...), with
+                speed from 0 to 1000 (maxrpm), if None the duty cycle is taken as proportional to rpm. Only the duty cycle is
+                used, so the table should be for the motor's own pwm frequency throughout
+        errtau: time constant in seconds over which the rms tracking error is averaged
+        """
+        self.wheel=wheel
+        self.maxrpm=maxrpm
+        self.maxdc=maxdc
+        self.kp=kp
+        self.ki=ki
+        self.table=((0, None, 0), (1000, None, maxdc)) if table is None else tuple(table)
+        self.errtau=errtau
+        self.target=0
+        self.rpm=0
+        self.error=0
+        self.sqerror=0
+        self.reset()
+
+    def reset(self):
+        """
+        clears the integral term, used when the motor is stopped or changes direction
+        """
+        self.integral=0
+
+    def feedforward(self, rpm):
+        """
+        returns the duty cycle expected to give the rpm (ignoring the sign of rpm)
+        """
+        speed=abs(rpm)/self.maxrpm*1000
+        tab=self.table
+        if speed >= tab[-1][0]:
+            return tab[-1][2]
+        i=0
+        while tab[i+1][0] < speed:
+            i+=1
+        if speed <= tab[i][0]:
+            return tab[i][2]
+        return tab[i][2]+(tab[i+1][2]-tab[i][2])*(speed-tab[i][0])/(tab[i+1][0]-tab[i][0])
+
+    def settarget(self, rpm):
+        if rpm*self.target <= 0:
+            self.reset()
+        self.target=rpm
+
+    def step(self, now, dt):
+        """
+        measures the wheel speed and returns the new duty cycle
+        """
+        self.wheel.sample(now)
+        self.rpm=self.wheel.rpm
+        self.error=self.target-self.rpm
+        decay=math.exp(-dt/self.errtau)
+        self.sqerror=self.sqerror*decay+self.error*self.error*(1-decay)
+        if self.target==0:
+            return 0
+        sign=1 if self.target > 0 else -1
+        ffwd=self.feedforward(self.target)/self.maxdc
+        err=self.error/self.maxrpm*sign
+        integral=self.integral+self.ki*err*dt
+        out=ffwd+self.kp*err+integral
+        if 0 <= out <= 1 or abs(integral) < abs(self.integral):
+            self.integral=integral         # no wind up while the output is pinned at a limit
+        out=max(0, min(1, ffwd+self.kp*err+self.integral))
+        return sign*out*self.maxdc
+
+    def getstate(self):
+        return {'target': round(self.target, 1), 'rpm': round(self.rpm, 1), 'error': round(self.error, 1),
+                'rmserror': round(math.sqrt(self.sqerror), 1), 'integral': round(self.integral, 3)}
+
 class tester(motorset.motorset):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, printlog=True, ramp=None, ticktime=MOTORTICK, speedcontrol=None, deadman=None,
+                clock=time.monotonic, autotick=True, **kwargs):
+        """
+        printlog: if True, each command and the resulting motor settings are printed
+        ramp    : if None, each command is applied to the motors immediately, otherwise a dict with the maximum rates of
+                  change of the (abstract, -1 to +1) motor speeds per second, the motor outputs are then moved towards the
+                  requested values every ticktime seconds:
+                    'accel': limit used when a motor is speeding up
+                    'decel': limit used when a motor is slowing down (or changing direction)
+        ticktime: interval in seconds between updates to the motors when ramping
+        speedcontrol: if not None, a dict that turns on closed loop speed control (see speedloop), which needs a rotation
+                  sensor (senseparams) on every motor. The motors are then driven by duty cycle to hold the rpm measured by
+                  the sensors at the requested speed, updated at a fixed rate. All entries are optional:
+                    'rate'  : loop updates per second (default 20), this replaces ticktime
+                    'window': time in seconds the measured rpm is averaged over (default .25)
+                    'kp', 'ki': gains for speedloop
+                    'maxrpm': rpm at full speed, either a single value or a dict of motor name: rpm such as written by
+                              calibrate.py (default from the motor's speedLimits)
+                    'tables': dict of motor name: feed-forward speed table (see speedloop)
+                  The edge counters for the sensors are kept in self.wheels (see odometry.makewheels) so an odometer can share them.
+        deadman : if not None, the motors are stopped if they are running and there has been no heartbeat (or motor command)
+                  for this many seconds, so the robot stops by itself if the driver's connection is lost. A running trajectory
+                  is left to finish (it always ends with a stop).
+        clock   : function that returns the time in seconds, used for the motor tick, trajectories and the dead-man
+        autotick: if True a thread runs the motor tick (when it is needed), if False nothing happens between commands until
+                  runticks is called, so the tester can be run on a simulated clock (see replay.py)
+        
+        all other parameters are passed to motorset
+        """
         super().__init__(*args, **kwargs)
+        self.printlog=printlog
         mlist=[mname for mname in self.motors.keys()]
         usespeed=True
         for mname in mlist:
             if self.motors[mname].speedLimits() is None:
                 usespeed=False
-        if usespeed:
-            self.mcontrols={
-                'smode': 'speed',
-                'motors': {
-                     mname: {
-                        'sfunc': self.motors[mname].speed,
-                        'smap' : self.motors[mname].speedLimits()} 
-                            for mname in mlist}}
+        self.smode='closed' if not speedcontrol is None else 'speed' if usespeed else 'DC'
+        if not speedcontrol is None:
+            motordefs=kwargs['motordefs'] if 'motordefs' in kwargs else args[0]
+            wheels=odometry.makewheels(motordefs, motors=self.motors, direction=self.direction)
+            if set(wheels.keys()) != set(mlist):
+                for counter, epr in wheels.values():
+                    counter.close()
+                raise ValueError('speedcontrol needs a rotation sensor on every motor, found %s' % ', '.join(wheels.keys()))
+            self.wheels=wheels
+            ticktime=1/speedcontrol.get('rate', 20)
+            gains={gname: speedcontrol[gname] for gname in ('kp', 'ki') if gname in speedcontrol}
+            tables=speedcontrol.get('tables', {})
+            maxrpms=speedcontrol.get('maxrpm')
+            if not isinstance(maxrpms, dict):
+                maxrpms={mname: maxrpms for mname in mlist}
+            self.mcontrols=tuple(motorcontrol(mname, self.motors[mname].DC, smax=self.motors[mname].maxDC(),
+                    loop=speedloop(odometry.wheelspeed(*wheels[mname], window=speedcontrol.get('window', .25)),
+                        maxrpm=maxrpms.get(mname) or self.motors[mname].speedLimits()[3],
+                        maxdc=self.motors[mname].maxDC(), table=tables.get(mname), **gains))
+                    for mname in mlist)
+        elif usespeed:
+            self.mcontrols=tuple(motorcontrol(mname, self.motors[mname].speed, smap=tuple(self.motors[mname].speedLimits()))
+                    for mname in mlist)
         else:
-            self.mcontrols={
-                'smode':'DC',
-                'motors': {
-                    mname: {
-                        'sfunc': self.motors[mname].DC, 
-                        'smax': self.motors[mname].maxDC()} 
-                            for mname in mlist}}
-        self.mcontrols['nullspeed']=150
-        self.mcontrols['nullturn']=150
+            self.mcontrols=tuple(motorcontrol(mname, self.motors[mname].DC, smax=self.motors[mname].maxDC()) for mname in mlist)
+        if speedcontrol is None:
+            self.wheels=None
+        self.nullspeed=NULLSPEED
+        self.nullturn=NULLTURN
+        self.laststate={'speed':0, 'turn':0, 'mix':{'left':0, 'right':0}, 'outputs':{mname: 0 for mname in mlist}}
+        self.targets={'left':0, 'right':0}
+        self.actuals={'left':0, 'right':0}
+        self.written={}
+        self.clock=clock
+        self.wstats={'ticks':0, 'writes':0, 'skipped':0, 'errors':0, 'started':clock()}
+        self.lock=threading.RLock()
+        self.ramp=ramp
+        self.ticktime=ticktime
+        self.autotick=autotick
+        self.ticker=None
+        self.lasttick=clock()
+        self.nexttick=self.lasttick+ticktime
+        self.tickwake=threading.Event()
+        self.trajectory={'state': 'none'}
+        self.loopstats={'loops': 0, 'maxlate': 0, 'meanlate': 0, 'maxcompute': 0, 'meancompute': 0}
+        self.deadman=deadman
+        self.lastheartbeat=clock()
+        self.deadstats={'stops': 0, 'last': None, 'maxlate': 0}
+        if not ramp is None or self.smode=='closed' or not deadman is None:
+            self._startticker()
 
     def setspeeddir(self, speedf, dirf):
         """
@@ -36,71 +305,462 @@ class tester(motorset.motorset):
         
         dirf  : from -1000 to + 1000 representing fastest possible turn left, through straight to fastest possible turn right
         """
-        print("request speed", speedf, '(', type(speedf).__name__, ') ','dir', dirf, '(', type(dirf).__name__, ')')
-        nullspeed=self.mcontrols['nullspeed']
-        speedl=0 if abs(speedf) < nullspeed else (abs(speedf)-nullspeed)/(1000-nullspeed)
-        if speedf < 0:
-            speedl=-speedl
-        speedr=speedl
-        # speedr/l now in range -1 to +1
-#        print('normed speed: %3.2f' % speedl)
-        nullturn=self.mcontrols['nullturn']
-        if abs(dirf) > nullturn:
-            spad=(abs(dirf)-nullturn)/(1000-nullturn)
-            if dirf < 0:
-                spad=-spad
-            # spad now in range -1 to +1
-            speedl+=spad
-            speedr-=spad
-            combo=abs(speedf)+abs(dirf)
-            if combo > 1000:
-                scale=1000/combo
-                speedl*=scale
-                speedr*=scale
-        print('abstract speeds: %3.2f   /   %3.2f' % (speedl, speedr))
-        smode = self.mcontrols['smode']
-        if smode=='DC':
-            lval=speedl*self.mcontrols['motors']['left']['smax']
-            rval=speedr*self.mcontrols['motors']['right']['smax']
-            print('DC mode settings left: %3d, right: %3d' % (lval,rval))
-            self.mcontrols['motors']['left']['sfunc'](lval)
-            self.mcontrols['motors']['right']['sfunc'](rval)
-        elif smode=='speed':
-            lpars=self.mcontrols['motors']['left']['smap']
-            rpars=self.mcontrols['motors']['right']['smap']
-            if -.001 < speedl < .001:
-                lval=0
-            elif speedl < 0:
-                lval=lpars[1]-(lpars[0]-lpars[1])*speedl
-            else:
-                lval=lpars[2]+(lpars[3]-lpars[2])*speedl
-            if -.001 < speedr < .001:
-                rval=0
-            elif speedr < 0:
-                rval=rpars[1]-(rpars[0]-rpars[1])*speedr
+        if self.printlog:
+            print("request speed", speedf, '(', type(speedf).__name__, ') ','dir', dirf, '(', type(dirf).__name__, ')')
+        speedl, speedr = mixspeeddir(speedf, dirf, self.nullspeed, self.nullturn)
+        if self.printlog:
+            print('abstract speeds: %3.2f   /   %3.2f' % (speedl, speedr))
+        self.lastheartbeat=self.clock()
+        with self.lock:
+            if self.trajectory['state']=='running':
+                self.trajectory['state']='cancelled'
+            self.laststate['speed']=speedf
+            self.laststate['turn']=dirf
+            self._settargets(speedl, speedr, self.printlog)
+
+    def _settargets(self, speedl, speedr, log=False):
+        """
+        sets new target speeds for the left and right motors, and updates the motors at once if there is no ramp
+        """
+        mix=self.laststate['mix']
+        mix['left']=speedl
+        mix['right']=speedr
+        self.targets['left']=speedl
+        self.targets['right']=speedr
+        if self.ramp is None:
+            self.actuals.update(self.targets)
+            self._apply(log)
+
+    def heartbeat(self):
+        """
+        called regularly by the driver's client to show it is still connected (see deadman)
+        """
+        self.lastheartbeat=self.clock()
+
+    def direction(self, mname):
+        """
+        returns the output last written to the motor, which is negative if the motor is being driven backwards. This follows
+        the ramp, so it is the direction the wheel is actually turning rather than the direction requested.
+        """
+        return self.written.get(mname, 0)
+
+    def _deadmandue(self):
+        """
+        returns the time the motors will be stopped if no heartbeat arrives, or None if the dead-man is not armed
+        """
+        if self.deadman is None or self.trajectory['state']=='running':
+            return None
+        if any(self.targets.values()) or any(self.actuals.values()):
+            return self.lastheartbeat+self.deadman
+        return None
+
+    def _checkdeadman(self, now):
+        """
+        stops the motors if the heartbeat has been missing for too long
+        """
+        due=self._deadmandue()
+        if not due is None and now >= due:
+            silent=now-self.lastheartbeat
+            self.stopMotor()
+            self.deadstats['stops']+=1
+            self.deadstats['last']=silent
+            self.deadstats['maxlate']=max(self.deadstats['maxlate'], now-due)
+            print('dead-man stop: no heartbeat for %4.0fms' % (silent*1000))
+
+    def getdeadmanstate(self):
+        """
+        returns a dict with the dead-man timeout and the number of stops it has made, with the time from the last heartbeat to
+        the motors being stopped for the last stop and the longest the stop came after it was due (in milliseconds), or None
+        if there is no dead-man
+        """
+        if self.deadman is None:
+            return None
+        dst=self.deadstats
+        return {'timeout': int(self.deadman*1000), 'stops': dst['stops'],
+                'last': None if dst['last'] is None else round(dst['last']*1000, 1), 'maxlate': round(dst['maxlate']*1000, 1),
+                'silent': round((self.clock()-self.lastheartbeat)*1000)}
+
+    def runtrajectory(self, points):
+        """
+        starts running a trajectory (see parsetrajectory), replacing any trajectory already running. Each point is applied
+        at its own time (not rounded to the motor tick). Any call to setspeeddir cancels the trajectory.
+        """
+        steps=parsetrajectory(points, self.nullspeed, self.nullturn)
+        self.lastheartbeat=self.clock()
+        with self.lock:
+            self.trajectory={'state': 'running', 'steps': steps, 'start': self.clock(), 'index': 0, 'maxlate': 0}
+            self.laststate['speed']=None
+            self.laststate['turn']=None
+        self._startticker()
+        self.tickwake.set()
+
+    def canceltrajectory(self):
+        """
+        stops a running trajectory, and stops the motors
+        """
+        with self.lock:
+            if self.trajectory['state']=='running':
+                self.trajectory['state']='cancelled'
+                self.laststate['speed']=0
+                self.laststate['turn']=0
+                self._settargets(0, 0)
+        self.tickwake.set()
+
+    def _trajectorydue(self):
+        """
+        returns the time the next trajectory point is due, or None
+        """
+        traj=self.trajectory
+        if traj['state']=='running':
+            return traj['start']+traj['steps'][traj['index']][0]
+        return None
+
+    def _runtrajectory(self, now):
+        """
+        applies any trajectory points that are now due
+        """
+        traj=self.trajectory
+        while traj['state']=='running' and traj['start']+traj['steps'][traj['index']][0] <= now:
+            toff, left, right = traj['steps'][traj['index']]
+            traj['maxlate']=max(traj['maxlate'], now-traj['start']-toff)
+            self._settargets(left, right)
+            traj['index']+=1
+            if traj['index'] >= len(traj['steps']):
+                traj['state']='done'
+                self.lastheartbeat=now      # the dead-man starts again from the end of the trajectory
+
+    def trajectorystate(self):
+        """
+        returns a dict with the progress of the current (or last) trajectory
+        """
+        with self.lock:
+            traj=self.trajectory
+            if traj['state']=='none':
+                return {'state': 'none'}
+            return {'state': traj['state'], 'index': traj['index'], 'points': len(traj['steps']),
+                    'elapsed': round(self.clock()-traj['start'], 3), 'duration': traj['steps'][-1][0],
+                    'maxlate': round(traj['maxlate'], 4)}
+
+    def _apply(self, log=False):
+        """
+        works out the output for every motor from the current (abstract) speeds in self.actuals and sends it to the motor, but
+        only if the (integer) value has changed since the last write.
+        """
+        smode = self.smode
+        outputs=self.laststate['outputs']
+        for mcont in self.mcontrols:
+            mname=mcont.name
+            mspeed=self.actuals[mname]
+            if smode=='closed':
+                mcont.loop.settarget(mspeed*mcont.loop.maxrpm)
+                continue
+            if smode=='DC':
+                mval=mspeed*mcont.smax
+            elif smode=='speed':
+                mpars=mcont.smap
+                if -.001 < mspeed < .001:
+                    mval=0
+                elif mspeed < 0:
+                    mval=mpars[1]-(mpars[0]-mpars[1])*mspeed
+                else:
+                    mval=mpars[2]+(mpars[3]-mpars[2])*mspeed
             else:
-                rval=rpars[2]+(rpars[3]-rpars[2])*speedr
-            print('speed mode settings left: %3d, right: %3d' % (lval,rval))
-            self.mcontrols['motors']['left']['sfunc'](lval)
-            self.mcontrols['motors']['right']['sfunc'](rval)
+                print('no code for smode %s' % smode)
+                return
+            self._write(mcont, mval, outputs)
+        if log:
+            print('%s mode settings %s' % (smode, ', '.join('%s: %3d' % mo for mo in outputs.items())))
+
+    def _write(self, mcont, mval, outputs):
+        """
+        sends the (rounded) value to the motor if it has changed since the last write
+        """
+        mval=int(round(mval))
+        outputs[mcont.name]=mval
+        if mval != self.written.get(mcont.name):
+            mcont.sfunc(mval)
+            self.written[mcont.name]=mval
+            self.wstats['writes']+=1
         else:
-            print('no code for smode %s' % smode)
-#        speedl=int(speedl/4)
-#        speedr=int(speedr/4)
-##        if speedf > -50:
-#            speedl, speedr = speedr, speedl
-#        print("request speed", speedf, '(', type(speedf).__name__, ') ','dir', dirf, '(', type(dirf).__name__, ')', '=> (%d, %d)' % (speedl,speedr))
-#        self.motors['left'].DC(speedl)
-#        self.motors['right'].DC(speedr)
+            self.wstats['skipped']+=1
+
+    def _runloops(self, now, elapsed):
+        """
+        runs the closed loop speed control for every motor and updates the loop timing stats
+        """
+        started=time.perf_counter()
+        outputs=self.laststate['outputs']
+        for mcont in self.mcontrols:
+            self._write(mcont, mcont.loop.step(now, elapsed), outputs)
+        lst=self.loopstats
+        late=max(elapsed-self.ticktime, 0)
+        compute=time.perf_counter()-started
+        lst['loops']+=1
+        lst['maxlate']=max(lst['maxlate'], late)
+        lst['meanlate']+=(late-lst['meanlate'])/min(lst['loops'], 100)
+        lst['maxcompute']=max(lst['maxcompute'], compute)
+        lst['meancompute']+=(compute-lst['meancompute'])/min(lst['loops'], 100)
+
+    def getloopstate(self):
+        """
+        returns a dict with the tracking of each motor (requested and measured rpm, latest and rms error) and the loop timing
+        in milliseconds (late is how far each loop started after it was due, compute is the time taken), or None if closed loop
+        speed control is not in use
+        """
+        if self.smode != 'closed':
+            return None
+        with self.lock:
+            lst=self.loopstats
+            return {'motors': {mcont.name: mcont.loop.getstate() for mcont in self.mcontrols}, 'rate': round(1/self.ticktime, 1),
+                    'loops': lst['loops'], 'maxlate': round(lst['maxlate']*1000, 2), 'meanlate': round(lst['meanlate']*1000, 2),
+                    'maxcompute': round(lst['maxcompute']*1000, 3), 'meancompute': round(lst['meancompute']*1000, 3)}
+
+    def _startticker(self):
+        if self.ticker is None and self.autotick:
+            with self.lock:
+                self.lasttick=self.clock()
+                self.nexttick=self.lasttick+self.ticktime
+            self.ticker=threading.Thread(target=self._ticker, name='motortick', daemon=True)
+            self.ticker.start()
+
+    def _ticker(self):
+        """
+        runs the motor tick every ticktime seconds until the ticker is cleared by close, and in between wakes up at the
+        exact time each trajectory point is due and when the dead-man is due
+        """
+        while not self.ticker is None:
+            with self.lock:
+                wakeat=self._nextdue()
+            wait=wakeat-self.clock()
+            if wait > 0:
+                self.tickwake.wait(wait)
+                self.tickwake.clear()
+            try:
+                self._rundue(self.clock())
+            except Exception as e:
+                # keep ticking so the ramp, a stop and the dead-man still work if a motor write fails
+                self.wstats['errors']+=1
+                print('motor tick failed: %s' % e)
+
+    def runticks(self, until, sleep=time.sleep):
+        """
+        for a tester with autotick False, runs everything that falls due up to time until (on clock): the motor ticks, any
+        trajectory points and a dead-man stop. sleep is called to move the clock on to each one.
+        """
+        while True:
+            with self.lock:
+                wakeat=self._nextdue()
+            if wakeat > until:
+                break
+            wait=wakeat-self.clock()
+            if wait > 0:
+                sleep(wait)
+            self._rundue(self.clock())
+        wait=until-self.clock()
+        if wait > 0:
+            sleep(wait)
+
+    def _nextdue(self):
+        """
+        returns the time the next motor tick, trajectory point or dead-man stop is due
+        """
+        return min([due for due in (self.nexttick, self._trajectorydue(), self._deadmandue()) if not due is None])
+
+    def _rundue(self, now):
+        """
+        runs the trajectory, dead-man and motor tick if they are due
+        """
+        with self.lock:
+            self._runtrajectory(now)
+            self._checkdeadman(now)
+            if now >= self.nexttick:
+                self._tick(now, now-self.lasttick)
+                self.lasttick=now
+                self.nexttick=max(self.nexttick+self.ticktime, now)
+
+    def _tick(self, now, elapsed):
+        """
+        moves the motor speeds towards the target speeds within the ramp limits and updates the motors
+        """
+        self.wstats['ticks']+=1
+        if not self.ramp is None and self.actuals!=self.targets:
+            for mname, target in self.targets.items():
+                self.actuals[mname]=rampspeed(self.actuals[mname], target, elapsed, self.ramp)
+            self._apply()
+        if self.smode=='closed':
+            self._runloops(now, elapsed)
+
+    def stopMotor(self, mlist=None):
+        """
+        stops the motors straight away (no ramping), used by the watchdog
+        """
+        with self.lock:
+            if self.trajectory['state']=='running':
+                self.trajectory['state']='cancelled'
+            outputs=self.laststate['outputs']
+            stopping=tuple(self.targets.keys()) if mlist is None else (mlist,) if isinstance(mlist, str) else mlist
+            for mname in stopping:
+                self.targets[mname]=0
+                self.actuals[mname]=0
+                self.written[mname]=0
+                outputs[mname]=0
+            for mcont in self.mcontrols:
+                if not mcont.loop is None and mcont.name in stopping:
+                    mcont.loop.settarget(0)
+            self.laststate['mix'].update(self.targets)
+            if not any(self.targets.values()):
+                self.laststate['speed']=0
+                self.laststate['turn']=0
+            if mlist is None:
+                super().stopMotor()
+            else:
+                super().stopMotor(mlist)
+
+    def close(self):
+        self.ticker=None
+        self.tickwake.set()
+        if not self.wheels is None:
+            for counter, epr in self.wheels.values():
+                counter.close()
+        super().close()
+
+    def getwritestats(self):
+        """
+        returns a dict with the number of motor ticks, motor writes made, writes skipped because the value was unchanged, ticks
+        that failed, and the average rate of writes per second
+        """
+        elapsed=self.clock()-self.wstats['started']
+        return {'ticks': self.wstats['ticks'], 'writes': self.wstats['writes'], 'skipped': self.wstats['skipped'],
+                'errors': self.wstats['errors'],
+                'writerate': round(self.wstats['writes']/elapsed, 2) if elapsed > 0 else 0}
+
+    def sendkwac(self):
+        """
+        there is no watchdog when the motors run in process, so nothing to do here
+        """
+        pass
+
+    def getcontrolparams(self):
+        """
+        returns a dict with the dead bands applied to speed and turn, the minimum useful interval between commands in
+        milliseconds, and the interval clients should send heartbeats at in milliseconds (None if there is no dead-man)
+        """
+        return {'nullspeed': self.nullspeed, 'nullturn': self.nullturn, 'cmdms': int(MOTORTICK*1000),
+                'hbms': heartbeatms(self.deadman)}
+
+    def getstate(self):
+        """
+        returns a dict with the last speed and turn requested, the abstract left / right speeds (mix), the resulting
+        motor outputs, the motor write stats and the closed loop speed control state (see getloopstate)
+        """
+        with self.lock:
+            state=self.laststate.copy()
+            state['mix']=state['mix'].copy()
+            state['outputs']=state['outputs'].copy()
+        state['writes']=self.getwritestats()
+        state['speedloop']=self.getloopstate()
+        state['deadman']=self.getdeadmanstate()
+        return state
 
 import asprocess
 
 class tstub(asprocess.runAsProcess):
     def __init__(self, **kwargs):
-        super().__init__('motoradds.tester', ticktime=.1, procName='motorprocess', kwacktimeout=3, timeoutfunction='stopMotor', **kwargs)
+        super().__init__('motoradds.tester', ticktime=MOTORTICK, procName='motorprocess', kwacktimeout=3, timeoutfunction='stopMotor', **kwargs)
+        self.deadman=kwargs.get('deadman')
+        self.ramp=kwargs.get('ramp')
+        self.rampest={}     # motor name: (time the requested speed changed, estimated speed at that time, requested speed)
+        self.lastheartbeat=time.monotonic()
+        self.laststate={'speed':0, 'turn':0, 'mix':{'left':0, 'right':0}}
+        self.trajectory={'state': 'none'}
 
     def setspeeddir(self, speedf, dirf):
         self.runOnProc('setspeeddir', 'a', speedf=speedf, dirf=dirf)
+        self.lastheartbeat=time.monotonic()
+        speedl, speedr = mixspeeddir(speedf, dirf)
+        if self.trajectory['state']=='running':
+            self.trajectory['state']='cancelled'
+        self.laststate={'speed':speedf, 'turn':dirf, 'mix':{'left':speedl, 'right':speedr}}
+        for mname in self.laststate['mix']:
+            self.direction(mname)       # note when the ramp started
+
+    def heartbeat(self):
+        """
+        see tester.heartbeat - the heartbeat also feeds the motor process watchdog
+        """
+        self.runOnProc('heartbeat', 'a')
+        self.sendkwac()
+        self.lastheartbeat=time.monotonic()
+
+    def direction(self, mname):
+        """
+        see tester.direction - the outputs are only known in the motor process, so this is estimated from the requested speeds
+        and the ramp
+        """
+        if self.trajectory['state']=='running':
+            self.trajectorystate()
+        target=self.laststate['mix'].get(mname, 0)
+        if self.ramp is None:
+            return target
+        now=time.monotonic()
+        est=self.rampest.get(mname)
+        if est is None or est[2] != target:
+            est=(now, 0 if est is None else rampspeed(est[1], est[2], now-est[0], self.ramp), target)
+            self.rampest[mname]=est
+        return rampspeed(est[1], target, now-est[0], self.ramp)
+
+    def runtrajectory(self, points):
+        """
+        see tester.runtrajectory - the trajectory is checked here as well so errors are reported straight away
+        """
+        steps=parsetrajectory(points)
+        self.runOnProc('runtrajectory', 'a', points=points)
+        self.trajectory={'state': 'running', 'steps': steps, 'start': time.monotonic()}
+        self.laststate={'speed':None, 'turn':None, 'mix':{'left':steps[0][1], 'right':steps[0][2]}}
+
+    def canceltrajectory(self):
+        self.runOnProc('canceltrajectory', 'a')
+        if self.trajectory['state']=='running':
+            self.trajectory['state']='cancelled'
+            self.laststate={'speed':0, 'turn':0, 'mix':{'left':0, 'right':0}}
+
+    def trajectorystate(self):
+        """
+        returns the progress of the trajectory, estimated from the time it was started as it runs in the motor process
+        """
+        traj=self.trajectory
+        if traj['state']=='none':
+            return {'state': 'none'}
+        elapsed=time.monotonic()-traj['start']
+        index=len([st for st in traj['steps'] if st[0] <= elapsed])
+        if traj['state']=='running':
+            if index > 0:
+                self.laststate['mix']={'left':traj['steps'][index-1][1], 'right':traj['steps'][index-1][2]}
+            if index >= len(traj['steps']):
+                traj['state']='done'
+                self.lastheartbeat=traj['start']+traj['steps'][-1][0]
+        return {'state': traj['state'], 'index': index, 'points': len(traj['steps']), 'elapsed': round(elapsed, 3),
+                'duration': traj['steps'][-1][0], 'estimated': True}
+
+    def getcontrolparams(self):
+        """
+        see tester.getcontrolparams
+        """
+        return {'nullspeed': NULLSPEED, 'nullturn': NULLTURN, 'cmdms': int(MOTORTICK*1000), 'hbms': heartbeatms(self.deadman)}
+
+    def getstate(self):
+        """
+        returns a dict with the last speed and turn requested and the abstract left / right speeds (mix). The motor outputs
+        are only known in the motor process, and a stop by the dead-man is assumed once it is due.
+        """
+        if self.trajectory['state']=='running':
+            self.trajectorystate()
+        if not self.deadman is None:
+            silent=time.monotonic()-self.lastheartbeat
+            if self.trajectory['state']!='running' and silent > self.deadman and any(self.laststate['mix'].values()):
+                self.laststate={'speed':0, 'turn':0, 'mix':{'left':0, 'right':0}}
+            self.laststate['deadman']={'timeout': int(self.deadman*1000), 'silent': round(silent*1000), 'estimated': True}
+        return self.laststate
 
     def close(self):
         self.runOnProc('close','e')
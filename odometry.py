@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+"""
+Counts the pulses from the rotation sensors on the motors, works out the speed of each wheel and keeps track of where the robot
+has got to (dead reckoning) from the movement of the left and right wheels.
+
+The edges on each pin are counted with pigpio's tally callback. This still runs a little python (pigpio's _tally) in pigpio's
+callback thread for every edge, but nothing more is done per edge - the counts are collected in a batch at a fixed rate and all
+the arithmetic is done then. The tally does not say which way the wheel is turning, so the direction is taken from the
+direction the motor is being driven.
+
+Each edge counter adds its own callbacks, so only one counter should be made for each pin in a process: when the motors run
+in process with closed loop speed control, the odometer shares the counters the speed control made (see motoradds.tester.wheels).
+When the motors run in a separate process (-a) the counts cannot be passed back, so both processes count the same pins.
+
+For testing, the counters can be fed from a synthetic pulse stream (syntheticedges) instead of pigpio, and the simulated motors
+in fakemotors provide one.
+"""
+import math, threading, time
+
+class edgecounter():
+    """
+    Base class for edge counters, count returns the signed total number of edges seen.
+    """
+    def count(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+class pigpioedges(edgecounter):
+    """
+    Counts edges on 1 or more pins using pigpio's tally callbacks. count can be called from more than 1 thread.
+    """
+    def __init__(self, pgp, pins, edges='both', direction=None):
+        """
+        pgp      : an instance of pigpio.pi
+        pins     : the gpio pins to count
+        edges    : 'both' to count rising and falling edges, otherwise just rising edges
+        direction: function that returns a negative value if the wheel is turning backwards
+        """
+        import pigpio
+        self.direction=direction
+        self.callbacks=[]
+        for p in pins:
+            pgp.set_mode(p, pigpio.INPUT)
+            self.callbacks.append(pgp.callback(p, pigpio.EITHER_EDGE if edges=='both' else pigpio.RISING_EDGE))
+        self.lasttally=0
+        self.total=0
+        self.lock=threading.Lock()
+
+    def count(self):
+        with self.lock:
+            tally=sum(cb.tally() for cb in self.callbacks)
+            delta=tally-self.lasttally
+            self.lasttally=tally
+            if not self.direction is None and self.direction() < 0:
+                delta=-delta
+            self.total+=delta
+            return self.total
+
+    def close(self):
+        for cb in self.callbacks:
+            cb.cancel()
+        self.callbacks=[]
+
+class syntheticedges(edgecounter):
+    """
+    An edge counter fed by a function or by calls to addedges, for testing and simulation.
+    """
+    def __init__(self, source=None):
+        """
+        source: if not None, a function that returns the signed total number of edges
+        """
+        self.source=source
+        self.total=0
+
+    def addedges(self, n):
+        self.total+=n
+
+    def count(self):
+        return self.total if self.source is None else self.source()
+
+def edgesperrev(senseparams):
+    """
+    works out the number of edges counted per revolution from a motor's senseparams
+    """
+    return senseparams['pulsesperrev']*(2 if senseparams.get('edges')=='both' else 1)*len(senseparams['pinss'])
+
+def makewheels(motordefs, motors=None, direction=None, pgp=None):
+    """
+    sets up an edge counter for each motor in motordefs that has senseparams, returns a dict of name: (counter, edgesperrev)
+
+    motordefs: the motor definitions from a config file
+    motors   : the motors dict of a motorset, if the motors have an edges method (simulated motors) they are used as the source
+    direction: function called with the motor name, returns a negative value if the motor is turning backwards
+    pgp      : an instance of pigpio.pi (one is started if needed and this is None)
+    """
+    wheels={}
+    for mdef in motordefs:
+        sp=mdef.get('senseparams')
+        if sp is None:
+            continue
+        mname=[mpart['name'] for mpart in mdef.values() if 'name' in mpart][0]
+        if not motors is None and hasattr(motors.get(mname), 'edges'):
+            counter=syntheticedges(source=motors[mname].edges)
+        else:
+            if pgp is None:
+                import pigpio
+                pgp=pigpio.pi()
+            counter=pigpioedges(pgp, sp['pinss'], sp.get('edges'), direction=None if direction is None else
+                    (lambda mn=mname: direction(mn)))
+        wheels[mname]=(counter, edgesperrev(sp))
+    return wheels
+
+class wheelspeed():
+    """
+    Works out the speed of a single wheel over a sliding window of counts
+    """
+    def __init__(self, counter, edgesperrev, window=.5):
+        """
+        counter    : an edgecounter for the wheel
+        edgesperrev: the number of edges counted per revolution of the wheel
+        window     : length in seconds of the window the rpm is averaged over
+        """
+        self.counter=counter
+        self.edgesperrev=edgesperrev
+        self.window=window
+        self.samples=[]
+        self.rpm=0
+        self.lastcount=counter.count()
+
+    def sample(self, now):
+        """
+        collects the latest count, returns the change in revolutions since the last sample
+        """
+        cnt=self.counter.count()
+        self.samples.append((now, cnt))
+        while len(self.samples) > 2 and now-self.samples[1][0] >= self.window:
+            self.samples.pop(0)
+        t0, c0 = self.samples[0]
+        self.rpm=0 if now <= t0 else (cnt-c0)/self.edgesperrev/(now-t0)*60
+        revs=(cnt-self.lastcount)/self.edgesperrev
+        self.lastcount=cnt
+        return revs
+
+class odometer():
+    """
+    Keeps track of the robot's position (x, y in the same units as wheelcircumference, heading in degrees clockwise from
+    the starting direction) from the left and right wheel movements, updated at a fixed rate.
+    """
+    def __init__(self, wheels, wheelcircumference, trackwidth, rate=20, window=.5, leftname='left', rightname='right',
+                autostart=True, closecounters=True):
+        """
+        wheels            : dict of name: (edgecounter, edges per revolution), see makewheels
+        wheelcircumference: distance travelled for 1 revolution of a wheel
+        trackwidth        : distance between the left and right wheels
+        rate              : number of updates per second
+        window            : window in seconds used to work out the rpm of each wheel
+        leftname          : name of the left wheel in wheels
+        rightname         : name of the right wheel in wheels
+        autostart         : if True a thread is started to run the updates, otherwise call step to update
+        closecounters     : if True the edge counters are closed by close, use False if the counters are shared
+        """
+        self.wheels={wname: wheelspeed(cntr, epr, window) for wname, (cntr, epr) in wheels.items()}
+        self.circumference=wheelcircumference
+        self.trackwidth=trackwidth
+        self.interval=1/rate
+        self.leftname=leftname
+        self.rightname=rightname
+        self.lock=threading.Lock()
+        self.reset()
+        self.ticks=0
+        self.overruns=0
+        self.running=autostart
+        self.closecounters=closecounters
+        if autostart:
+            self.ticker=threading.Thread(target=self._ticker, name='odometer', daemon=True)
+            self.ticker.start()
+
+    def reset(self):
+        """
+        sets the position back to 0, 0 heading 0
+        """
+        with self.lock:
+            self.x=0
+            self.y=0
+            self.heading=0
+            self.distance=0
+
+    def _ticker(self):
+        nexttick=time.monotonic()
+        while self.running:
+            self.step(time.monotonic())
+            nexttick+=self.interval
+            wait=nexttick-time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                self.overruns+=1
+                nexttick=time.monotonic()
+
+    def step(self, now):
+        """
+        collects the counts from all the wheels and updates the position
+        """
+        revs={wname: wheel.sample(now) for wname, wheel in self.wheels.items()}
+        dleft=revs.get(self.leftname, 0)*self.circumference
+        dright=revs.get(self.rightname, 0)*self.circumference
+        dcentre=(dleft+dright)/2
+        dheading=(dleft-dright)/self.trackwidth
+        with self.lock:
+            midheading=self.heading+dheading/2
+            self.x+=dcentre*math.sin(midheading)
+            self.y+=dcentre*math.cos(midheading)
+            self.heading+=dheading
+            self.distance+=abs(dcentre)
+            self.ticks+=1
+
+    def getstate(self):
+        """
+        returns a dict with the position and wheel speeds, suitable for telemetry
+        """
+        with self.lock:
+            return {'x': round(self.x, 4), 'y': round(self.y, 4), 'heading': round(math.degrees(self.heading) % 360, 1),
+                    'distance': round(self.distance, 4), 'rpm': {wname: round(wheel.rpm, 1) for wname, wheel in self.wheels.items()},
+                    'ticks': self.ticks, 'overruns': self.overruns}
+
+    def close(self):
+        self.running=False
+        if self.closecounters:
+            for wheel in self.wheels.values():
+                wheel.counter.close()
+
+if __name__ == '__main__':
+    # run a synthetic pulse stream through an odometer: 2m straight ahead then a spin on the spot through 90 degrees
+    left, right = syntheticedges(), syntheticedges()
+    odo=odometer({'left': (left, 12), 'right': (right, 12)}, wheelcircumference=.2, trackwidth=.15, autostart=False)
+    t=0
+    for i in range(100):   # 10 revs each wheel over 5 seconds => 120rpm, 2m
+        left.addedges(1.2)
+        right.addedges(1.2)
+        t+=.05
+        odo.step(t)
+    print('after straight run:', odo.getstate())
+    spinedges=.15*math.pi/4/.2*12    # each wheel travels a quarter of the circle with diameter trackwidth
+    for i in range(20):
+        left.addedges(spinedges/20)
+        right.addedges(-spinedges/20)
+        t+=.05
+        odo.step(t)
+    print('after spin right  :', odo.getstate())
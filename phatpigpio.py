@@ -57,7 +57,10 @@ class motor():
     A class to provide simple pwm control - typically of a motor - via a pair of pins to an H bridge such as
     DRV8833PWP as found on a pimoroni explorer HAT.
     
+    Uses __slots__ to keep the per motor memory small.
     """
+    __slots__=('piggy', 'mf', 'mb', 'Hz', 'range', 'lastdc', 'loglevel', 'name', 'speedtab')
+
     def __init__(self, name, pinf, pinb, frequency, range=255, speedtable=None, piggy=None, loglevel=0, **kwargs):
         """
         Initialises a single PWM motor using pigpio controlling an H bridge 
@@ -9,8 +9,10 @@ def _runcmd(cmd):
 
 def get_state(sname):
     if sname=='under_volt':
-        resp=(int(_runcmd(('vcgencmd', 'get_throttled')).split(b'=')[1],0) & 1) > 0
+        resp=(get_state('throttled') & 1) > 0
         return resp
+    elif sname=='throttled':
+        return int(_runcmd(('vcgencmd', 'get_throttled')).split(b'=')[1],0)
     elif sname=='camera_on':
         return int([ent for ent in _runcmd(('vcgencmd', 'get_camera')).split(b' ') if ent.startswith(b'detected')][0].split(b'=')[1]) > 0
     elif sname=='camera_enabled':
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""
+Replays a journal recorded by camservermotorsu4vl.py (-j option) through motoradds.tester, normally against simulated motors
+(use -p fakemotors), and reports the resulting motor outputs and the throughput achieved.
+
+For example to replay as fast as possible:
+
+    python3 replay.py -p fakemotors -r 0 trike-config robot.jnl
+
+When the config file has a ramp or speed control the motor outputs only change on the motor tick, so when replaying as fast as
+possible the tester is run on a simulated clock (see calibrate.simclock) that is moved on to each record's recorded time, with
+the motor ticks that fall due in between run as it goes.
+"""
+import argparse, importlib, itertools, sys, os, time
+import journal
+from calibrate import simclock
+
+DEFSETTLE       = 1     # seconds the simulated clock is run on after the last record, so ramps can finish
+
+DEFPIMOTORLIB   = "fakemotors"
+DEFRATE         = 1
+DEFKEEP         = 5
+
+def replay(tester, records, rate=1, tracefile=None, sleep=None, settle=DEFSETTLE):
+    """
+    feeds the journal records through the tester, returns a dict with summary information.
+
+    tester   : a motoradds.tester (or anything with setspeeddir, runtrajectory, canceltrajectory, getstate and sendkwac methods)
+    records  : iterable of records (see journal.readjournal)
+    rate     : replay speed, 1 replays at the recorded timing, 2 twice as fast, 0 as fast as possible
+    tracefile: if not None, an open file to which a line with the motor outputs is written after each command
+    sleep    : if not None, the tester was made with autotick False on a simulated clock starting at 0, and sleep moves that
+               clock on. Before each record the tester's motor ticks are run up to the record's time (from the first record).
+    settle   : with sleep, the seconds the clock is run on after the last record
+    """
+    counts={}
+    lateness=[]
+    outranges={}
+    replaystart=None
+    def noteoutputs():
+        # with a ramp or speed control the outputs also change between commands, so they are checked at every record
+        outputs=tester.getstate().get('outputs', {})
+        for mname, mval in outputs.items():
+            lo, hi = outranges.get(mname, (mval, mval))
+            outranges[mname]=(min(lo, mval), max(hi, mval))
+        return outputs
+    records=iter(records)
+    for tstamp, kind, v1, v2 in records:
+        if replaystart is None:
+            replaystart=time.perf_counter()
+            recstart=tstamp
+        if rate > 0:
+            due=replaystart+(tstamp-recstart)/rate
+            wait=due-time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                lateness.append(-wait)
+        if not sleep is None:
+            tester.runticks(tstamp-recstart, sleep=sleep)
+        noteoutputs()
+        if kind=='setspeedturn2':
+            tester.setspeeddir(speedf=v1, dirf=v2)
+            outputs=noteoutputs()
+            if not tracefile is None:
+                tracefile.write('%.4f,%d,%d,%s\n' % (tstamp-recstart, v1, v2, ','.join('%.1f' % outputs[m] for m in sorted(outputs))))
+        elif kind=='trajectory':
+            # the points follow in their own records, with the time offset in place of the timestamp
+            points=[[toff, {'left': left, 'right': right}] for toff, _, left, right in itertools.islice(records, v1)]
+            tester.runtrajectory(points)
+        elif kind=='canceltrajectory':
+            tester.canceltrajectory()
+        else:
+            tester.sendkwac()
+        counts[kind]=counts.get(kind, 0)+1
+    if not sleep is None and not replaystart is None:
+        tester.runticks(tstamp-recstart+settle, sleep=sleep)
+    noteoutputs()
+    elapsed=0 if replaystart is None else time.perf_counter()-replaystart
+    recorded=0 if replaystart is None else tstamp-recstart
+    total=sum(counts.values())
+    return {
+        'counts'    : counts,
+        'elapsed'   : elapsed,
+        'recorded'  : recorded,
+        'rate'      : total/elapsed if elapsed > 0 else 0,
+        'maxlate'   : max(lateness) if lateness else 0,
+        'meanlate'  : sum(lateness)/len(lateness) if lateness else 0,
+        'outranges' : outranges,
+        'final'     : tester.getstate(),
+    }
+
+if __name__ == '__main__':
+    clparse = argparse.ArgumentParser(description='replays a journal recorded by camservermotorsu4vl.py against the motors '
+            'specified in the configuration file (simulated motors by default).')
+    clparse.add_argument( "-p", "--pimotorlib", default=DEFPIMOTORLIB,
+        help="pimotors library, default %s (simulated motors)" % DEFPIMOTORLIB)
+    clparse.add_argument( "-r", "--rate", type=float, default=DEFRATE,
+        help="replay speed, 1 for the recorded timing, 0 for as fast as possible, default %3.1f" % DEFRATE)
+    clparse.add_argument( "-k", "--keep", type=int, default=DEFKEEP,
+        help="number of rotated journal files to look for, default %d" % DEFKEEP)
+    clparse.add_argument( "-t", "--trace", help="write the motor outputs after each command to this (csv) file")
+    clparse.add_argument('config', help='configuration file to use')
+    clparse.add_argument('journal', help='journal file to replay')
+    args=clparse.parse_args()
+    sys.path.insert(1, args.pimotorlib)
+    sys.path.insert(1, os.getcwd())
+    conf=importlib.import_module(args.config)
+    import motoradds
+    mparams=motoradds.configparams(conf)
+    if args.rate > 0:
+        mdrive=motoradds.tester(motordefs=conf.motordef, printlog=False, **mparams)
+        sleep=None
+    else:
+        sclock=simclock()
+        mdrive=motoradds.tester(motordefs=conf.motordef, printlog=False, clock=sclock.now, autotick=False, **mparams)
+        sclock.addmotors(mdrive.motors.values())
+        sleep=sclock.sleep
+    jfiles=journal.journalfiles(args.journal, args.keep)
+    tfile=None if args.trace is None else open(args.trace, 'w')
+    try:
+        res=replay(mdrive, journal.readjournal(jfiles), rate=args.rate, tracefile=tfile, sleep=sleep)
+    except KeyboardInterrupt:
+        res=None
+    if not tfile is None:
+        tfile.close()
+    if not res is None:
+        print('replayed %s from %d file(s): %s' % (args.journal, len(jfiles),
+                ', '.join('%d %s' % (v, k) for k, v in sorted(res['counts'].items()))))
+        print('recorded over %4.2fs, replayed in %4.2fs, %5.1f requests per second' % (res['recorded'], res['elapsed'], res['rate']))
+        if args.rate > 0:
+            print('replay lateness max %5.2fms, mean %5.2fms' % (res['maxlate']*1000, res['meanlate']*1000))
+        for mname, (lo, hi) in sorted(res['outranges'].items()):
+            wcount=getattr(mdrive.motors[mname], 'writes', None)
+            print('motor %s: output range %5.1f to %5.1f%s' % (mname, lo, hi, '' if wcount is None else ', %d writes' % wcount))
+        wstats=mdrive.getwritestats()
+        print('motor ticks %d, writes %d (%5.2f per second), %d unchanged values not written' % (
+                wstats['ticks'], wstats['writes'], wstats['writerate'], wstats['skipped']))
+        print('final state %s' % str(res['final']))
+    mdrive.close()
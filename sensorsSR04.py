@@ -20,7 +20,11 @@ class simpleHC_SR04():
     """
     The class for a single sensor. After initialisation, it merely tracks edges on the sense pin via the pigpio callbacks and
     takes appropriate action.
+
+    Uses __slots__ to keep the per sensor memory small, the callbacks create no objects apart from the values they report.
     """
+    __slots__=('parent', 'trigp', 'sensp', 'lowerbound', 'upperbound', 'name', 'lastval', 'lastgood', 'measurestart', 'state')
+
     def __init__(self, trigger, sense, bounds, name, parent, **ignore):
         """
         An individual sensor object merely looks after gpio pin connected to the sense output of an HC-SR04. Initiasing it, 
@@ -53,12 +57,6 @@ class simpleHC_SR04():
         self.parent.pgp.callback(self.sensp, pigpio.EITHER_EDGE, self.echo)
         self.measurestart=None
         self.state='idle'
-        self.notmsg= {
-            'sensor':self.name,
-            'cmdist': 0,
-            'tstamp': 0,
-            'good'  : False,
-        }
         self.logmsg(1, None, 'HC-SR04 %s initialised. Pin %d to trigger, pin %d for echo sense time' % (self.name, self.trigp, self.sensp))
 
     def stop(self):
@@ -77,9 +75,10 @@ class simpleHC_SR04():
 
     def set_state(self, tstamp, newstate, msg, level):
         """
-        single place to update the state and log the change.
+        single place to update the state and log the change. The log message is only formatted if it will be logged.
         """
-        self.logmsg(level, tstamp, 'state %10s->%10s, %s.' % (self.state, newstate, msg))
+        if level & self.parent.log != 0:
+            self.logmsg(level, tstamp, 'state %10s->%10s, %s.' % (self.state, newstate, msg))
         self.state=newstate
 
     def echo(self, pinno, level, tick):
@@ -113,12 +112,12 @@ class simpleHC_SR04():
                 mst=lastmtime/1000          # time in milliseconds is a bit friendlier to read
                 goodmeasure = self.lowerbound < dist < self.upperbound
                 if goodmeasure:
-                    msg='good measure: %4.1fcm, %3.1fms' % (dist, mst)
                     self.lastgood=tick
                     self.lastval=dist
+                if self.parent.log & 8 != 0:
+                    self.set_state(tstamp, 'idle', '%s measure: %4.1fcm, %3.1fms' % ('good' if goodmeasure else 'bad ', dist, mst), 8)
                 else:
-                    msg='bad  measure: %4.1fcm, %3.1fms' % (dist, mst)
-                self.set_state(tstamp, 'idle', msg, 8)
+                    self.state='idle'
                 self.tell(dist, tstamp, goodmeasure)
             else:
                 self.set_state(tick, 'error', 'unexpected falling edge', 4)
@@ -133,15 +132,14 @@ class simpleHC_SR04():
 
         Calls the main class' tell method with details of the measure made. 
         """
-        self.notmsg['cmdist'] = cmdist
-        self.notmsg['tstamp'] = tstamp
-        self.notmsg['good']   = isOK
-        self.parent.tell(self.notmsg)        
+        self.parent.tell(self.name, cmdist, tstamp, isOK)
 
 class averageHC_SR04(simpleHC_SR04):
     """
     Version of sensor which averages the previous n readings
     """
+    __slots__=('avover', 'av', 'badcount')
+
     def __init__(self, avover=4, **params):
         self.avover=avover
         self.av=None
@@ -163,10 +161,7 @@ class averageHC_SR04(simpleHC_SR04):
         else:
             self.av=(self.av*(self.avover-1)+fdist)/self.avover
         self.badcount=0
-        self.notmsg['cmdist'] = self.av
-        self.notmsg['tstamp'] = tstamp
-        self.notmsg['good']   = isOK
-        self.parent.tell(self.notmsg)     
+        self.parent.tell(self.name, self.av, tstamp, isOK)
 
 defprintformat='{sensor}, {good:d}, {M:02d}:{S:02.2f},      {cmdist:5.2f}cm'
 deflogformat=defprintformat+'/n'
@@ -218,7 +213,9 @@ class usSensors():
             sx['parent']=self
             self.sensors[sx['name']]=sx['class'](**sx)
         self.running=True
-        self.setupTriggers(period, [(s['trigger'], s['trigoffset']) for s in sensors if 'trigoffset' in s])   # use the list param so we process in the order declared
+        self.period=period
+        self.trigpins=[(s['trigger'], s['trigoffset']) for s in sensors if 'trigoffset' in s]   # use the list param so we process in the order declared
+        self.setupTriggers(period, self.trigpins)
         self.logmsg(1, None, None, '%d sensors started' % len(sensors))
 
     def logmsg(self, level, tstamp, sname, msg):
@@ -254,23 +251,34 @@ class usSensors():
         self.pgp.wave_send_repeat(self.waveid)
         self.logmsg(1, None, None, 'wave created (%d), time:%3.3f ms' % (self.waveid, wavetime))
 
+    def setperiod(self, period):
+        """
+        changes the interval between measurements (in seconds)
+        """
+        if period != self.period and self.running:
+            self.pgp.wave_tx_stop()
+            self.pgp.wave_delete(self.waveid)
+            self.period=period
+            self.setupTriggers(period, self.trigpins)
+
     def getlastgood(self):
         """
         returns the last good readings from all the sensors. A polling type of access
         """
         return {sk: (-1 if sv.lastgood==-1 else sv.lastval) for sk, sv in self.sensors.items()}
 
-    def tell(self, msg):
-        if not self.logformat is None:
-            m, s = divmod(msg['tstamp']/1000000,60)
+    def tell(self, sensor, cmdist, tstamp, good):
+        """
+        called by the sensors with each measure made (see simpleHC_SR04.tell), prints and / or logs it using printformat and
+        logformat. The format strings can use the fields sensor, cmdist, tstamp, good, H, M and S.
+        """
+        if not self.logformat is None and not (self.printformat is None and self.logfile is None):
+            m, s = divmod(tstamp/1000000,60)
             h, m = divmod(m,60)
-            msg['H']=int(h)
-            msg['M']=int(m)
-            msg['S']=s
             if not self.printformat is None:
-                print(self.printformat.format(**msg))
+                print(self.printformat.format(sensor=sensor, cmdist=cmdist, tstamp=tstamp, good=good, H=int(h), M=int(m), S=s))
             if not self.logfile is None:
-                self.logfile.write(self.logformat.format(**msg))
+                self.logfile.write(self.logformat.format(sensor=sensor, cmdist=cmdist, tstamp=tstamp, good=good, H=int(h), M=int(m), S=s))
 
     def stop(self):
         self.running=False
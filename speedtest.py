@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+"""
+Drives simulated motors (fakemotors) through motoradds.tester with closed loop speed control and reports how well the measured
+wheel speeds track the requested speeds, with the loop timing. Part way through, the supply to one motor is cut (as if its
+battery was flattening or it was pulling a heavier load) to show the wheels being held together.
+
+Use -o to run the same sequence open loop for comparison. For example:
+
+    python3 speedtest.py trike-config
+    python3 speedtest.py -o trike-config
+"""
+import argparse, importlib, os, sys, time
+
+DEFSAG          = .8
+DEFPHASE        = 3
+
+sequence=(  # (description, speed, turn, supply to the right motor)
+    ('straight',            600,    0,  1),
+    ('straight, sagging',   600,    0,  DEFSAG),
+    ('turning, sagging',    600,  300,  DEFSAG),
+    ('slow, sagging',       300,    0,  DEFSAG),
+    ('stop',                  0,    0,  DEFSAG),
+)
+
+def runsequence(mdrive, phasetime=DEFPHASE, sag=DEFSAG, settle=1):
+    """
+    runs each phase of the sequence for phasetime seconds, returns a list of dicts with the mean rpm of each motor (measured
+    after settle seconds) and the rpm each motor was expected to reach
+    """
+    results=[]
+    for desc, speed, turn, supply in sequence:
+        mdrive.motors['right'].supply=sag if supply < 1 else 1
+        mdrive.setspeeddir(speedf=speed, dirf=turn)
+        started=time.monotonic()
+        time.sleep(settle)
+        sums={mname: 0 for mname in mdrive.motors}
+        count=0
+        while time.monotonic()-started < phasetime:
+            for mname, m in mdrive.motors.items():
+                sums[mname]+=m.getrpm()
+            count+=1
+            time.sleep(.02)
+        mix=mdrive.getstate()['mix']
+        results.append({'phase': desc, 'rpm': {mname: sums[mname]/count for mname in sums},
+                'expected': {mname: mix[mname]*mdrive.motors[mname].maxrpm for mname in mix}})
+    return results
+
+if __name__ == '__main__':
+    clparse = argparse.ArgumentParser(description='runs closed loop speed control against simulated motors and reports the '
+            'tracking.')
+    clparse.add_argument( "-o", "--openloop", action='store_true', help="run open loop (no speed control) for comparison")
+    clparse.add_argument( "-s", "--sag", type=float, default=DEFSAG,
+        help="fraction of its normal supply given to the right motor in the later phases, default %3.2f" % DEFSAG)
+    clparse.add_argument( "-t", "--phasetime", type=float, default=DEFPHASE,
+        help="seconds each phase of the test runs for, default %3.1f" % DEFPHASE)
+    clparse.add_argument('config', help='configuration file to use (the motors need senseparams)')
+    args=clparse.parse_args()
+    sys.path.insert(1, 'fakemotors')
+    sys.path.insert(1, os.getcwd())
+    conf=importlib.import_module(args.config)
+    import motoradds
+    mparams=motoradds.configparams(conf)
+    mparams.pop('ramp', None)
+    if args.openloop:
+        mparams.pop('speedcontrol', None)
+    else:
+        mparams.setdefault('speedcontrol', {})
+    mdrive=motoradds.tester(motordefs=conf.motordef, printlog=False, **mparams)
+    try:
+        results=runsequence(mdrive, phasetime=args.phasetime, sag=args.sag)
+    except KeyboardInterrupt:
+        results=None
+    loopstate=mdrive.getloopstate()
+    mdrive.close()
+    if not results is None:
+        print('%s, right motor supply cut to %d%% after the first phase' % ('open loop' if args.openloop else 'closed loop',
+                args.sag*100))
+        for res in results:
+            print('%-20s %s, left - right %6.1frpm' % (res['phase'], ', '.join('%s %6.1frpm (expected %6.1f)' % (
+                    mname, res['rpm'][mname], res['expected'][mname]) for mname in sorted(res['rpm'])),
+                    res['rpm']['left']-res['rpm']['right']-res['expected']['left']+res['expected']['right']))
+        if not loopstate is None:
+            print('rms tracking error over the last few seconds: %s' % ', '.join('%s %5.1frpm' % (mname, mstate['rmserror'])
+                    for mname, mstate in sorted(loopstate['motors'].items())))
+            print('%d loops at %3.1f per second, late mean %5.2fms max %5.2fms, compute mean %5.3fms max %5.3fms' % (
+                    loopstate['loops'], loopstate['rate'], loopstate['meanlate'], loopstate['maxlate'],
+                    loopstate['meancompute'], loopstate['maxcompute']))
@@ -10,3 +10,12 @@ motordef=(
      'senseparams': {'pinss': ((9, 10)), 'edges': 'both', 'pulsesperrev':3},
      'analysemotor':{'name':'right'},},
 )
+
+# used to work out where the robot has got to from the sensors on the motors (see odometry.py) - measure your own chassis!
+odometry={'wheelcircumference': .204, 'trackwidth': .135, 'rate': 20}
+
+# maximum change in motor speed per second (full speed forward is 1, full speed backward -1), see motoradds.tester
+ramp={'accel': 2, 'decel': 4}
+
+# hold each wheel at the requested rpm using the rotation sensors (closed loop), see motoradds.tester and speedtest.py
+speedcontrol={'rate': 20, 'kp': .6, 'ki': 3}
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+"""
+A compact binary UDP protocol for driving the robot with the lowest possible latency.
+
+A lost packet never holds up later commands (as it would on a TCP connection), and packets that arrive out of order are dropped
+so an old command can never override a newer one. A packet more than SEQWINDOW sequence numbers behind the last one, or from a
+client not heard from for SEQFORGET seconds, is taken as coming from a restarted client and accepted.
+
+Each command is a single 16 byte datagram (network byte order):
+    sequence number (uint32), speed (int16), turn (int16), client timestamp (uint64, microseconds on the client's clock)
+and each command that is not dropped is answered with a 17 byte ack:
+    sequence number (uint32), client timestamp echoed back (uint64), motor side latency (uint32, microseconds from the
+    datagram arriving to the motor command completing), status (uint8, see below)
+
+The motor command completes when the motors have been told the new speeds. Only with the motors in process and no ramp or speed
+control does that mean the outputs have changed. With a ramp or speed control the outputs start to follow on the next motor
+tick (up to 1 tick later), and with the motors in a separate process (-a) the command has only been passed to that process.
+
+Run this module to benchmark the protocol against a robot, for example:
+
+    python3 udpcontrol.py -n 200 -r 10 localhost
+
+The robot accepts about one command per motor tick (cmdms in its /config, 100ms so 10 per second) from each client. Commands
+sent faster than that are acked as too fast and are not resent, so keep the rate at or below the robot's limit.
+"""
+import socket, struct, threading, time
+import arbiter as arbitermod
+
+cmdformat = struct.Struct('!IhhQ')
+ackformat = struct.Struct('!IQIB')
+
+DEFUDPPORT  = 8089
+DEFRATE     = 10      # commands per second, one per motor tick (see motoradds.MOTORTICK)
+
+SEQWINDOW   = 64    # packets up to this many sequence numbers late are dropped
+SEQFORGET   = 5     # seconds after which a silent client's sequence number is forgotten
+
+STATUSAPPLIED   = 0
+STATUSSPECTATOR = 1     # another client is driving
+STATUSTOOFAST   = 2     # sent faster than the motors can use
+statusnames = {STATUSAPPLIED: 'applied', STATUSSPECTATOR: 'spectator', STATUSTOOFAST: 'too fast'}
+
+def seqstale(seq, lastseq, window=SEQWINDOW):
+    """
+    returns True if seq is the same as lastseq or up to window before it, allowing for the sequence number wrapping round
+    """
+    return ((lastseq-seq) & 0xffffffff) <= window
+
+class udpcontroller():
+    """
+    Listens for command datagrams and passes them to the motors
+    """
+    def __init__(self, port, drive, arbiter=None, journ=None):
+        """
+        port   : the udp port to listen on
+        drive  : function called with speed and turn for each command to be actioned
+        arbiter: if not None, a driverarbiter that decides which clients may drive (see arbiter.py)
+        journ  : if not None, a journal in which actioned commands are recorded
+        """
+        self.drive=drive
+        self.arbiter=arbiter
+        self.journ=journ
+        self.sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', port))
+        self.lastseqs={}    # client address: (last sequence number, time it arrived)
+        self.lastprune=time.perf_counter()
+        self.stats={'received': 0, 'applied': 0, 'outoforder': 0, 'rejected': 0, 'bad': 0, 'maxlatency': 0, 'totlatency': 0}
+        self.running=True
+        self.listener=threading.Thread(target=self._listener, name='udpcontrol', daemon=True)
+        self.listener.start()
+
+    def _listener(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except OSError:
+                break
+            arrived=time.perf_counter()
+            self.stats['received']+=1
+            if len(data) != cmdformat.size:
+                self.stats['bad']+=1
+                continue
+            seq, speed, turn, ctstamp = cmdformat.unpack(data)
+            last=self.lastseqs.get(addr)
+            if not last is None and arrived-last[1] < SEQFORGET and seqstale(seq, last[0]):
+                self.stats['outoforder']+=1
+                continue
+            self.lastseqs[addr]=(seq, arrived)
+            if arrived-self.lastprune > SEQFORGET:
+                self.lastprune=arrived
+                for oldaddr in [caddr for caddr, (cseq, cseen) in self.lastseqs.items() if arrived-cseen > SEQFORGET]:
+                    del self.lastseqs[oldaddr]
+            if self.arbiter is None:
+                cmdres=arbitermod.ACCEPTED
+            else:
+                cmdres=self.arbiter.command('udp:%s' % addr[0], isstop=speed==0 and turn==0)
+            if cmdres==arbitermod.ACCEPTED:
+                if not self.journ is None:
+                    self.journ.record('setspeedturn2', speed, turn)
+                self.drive(speed, turn)
+                status=STATUSAPPLIED
+                self.stats['applied']+=1
+            else:
+                status=STATUSSPECTATOR if cmdres==arbitermod.SPECTATOR else STATUSTOOFAST
+                self.stats['rejected']+=1
+            latency=int((time.perf_counter()-arrived)*1000000)
+            if status==STATUSAPPLIED:
+                self.stats['maxlatency']=max(self.stats['maxlatency'], latency)
+                self.stats['totlatency']+=latency
+            try:
+                self.sock.sendto(ackformat.pack(seq, ctstamp, min(latency, 0xffffffff), status), addr)
+            except OSError:
+                pass
+
+    def getstate(self):
+        """
+        returns a dict with the counts of datagrams, the motor side latency in microseconds (see the module description) and
+        the number of clients heard from recently, suitable for telemetry
+        """
+        st=self.stats.copy()
+        st['meanlatency']=round(st.pop('totlatency')/st['applied']) if st['applied'] > 0 else 0
+        st['clients']=len(self.lastseqs)
+        return st
+
+    def close(self):
+        self.running=False
+        self.sock.close()
+
+def benchmark(host, port=DEFUDPPORT, count=200, rate=DEFRATE, speed=300, turn=0, timeout=1):
+    """
+    sends count commands at rate per second and collects the acks, returns a dict with the results
+    """
+    sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(.001)
+    seq=int(time.time()) & 0xffffffff
+    rtts=[]
+    latencies=[]
+    statuses={}
+    interval=1/rate
+    nextsend=time.perf_counter()
+    sent=0
+    lastsend=None
+    while True:
+        now=time.perf_counter()
+        if sent < count and now >= nextsend:
+            seq=(seq+1) & 0xffffffff
+            # the last command is always a stop
+            sock.sendto(cmdformat.pack(seq, speed if sent < count-1 else 0, turn if sent < count-1 else 0,
+                    int(time.time()*1000000)), (host, port))
+            sent+=1
+            lastsend=now
+            nextsend+=interval
+        elif sent >= count and now-lastsend > timeout:
+            break
+        try:
+            data=sock.recv(64)
+        except socket.timeout:
+            continue
+        if len(data)==ackformat.size:
+            aseq, ctstamp, latency, status = ackformat.unpack(data)
+            rtts.append(time.time()*1000000-ctstamp)
+            statuses[statusnames.get(status, status)]=statuses.get(statusnames.get(status, status), 0)+1
+            if status==STATUSAPPLIED:
+                latencies.append(latency)
+    sock.close()
+    rtts.sort()
+    return {
+        'sent'      : sent,
+        'acked'     : len(rtts),
+        'statuses'  : statuses,
+        'rttmean'   : sum(rtts)/len(rtts) if rtts else 0,
+        'rtt95'     : rtts[int(len(rtts)*.95)] if rtts else 0,
+        'rttmax'    : rtts[-1] if rtts else 0,
+        'motormean' : sum(latencies)/len(latencies) if latencies else 0,
+        'motormax'  : max(latencies) if latencies else 0,
+    }
+
+if __name__ == '__main__':
+    import argparse
+    clparse = argparse.ArgumentParser(description='benchmarks the udp control protocol against a robot running '
+            'camservermotorsu4vl.py with the -u option.')
+    clparse.add_argument( "-p", "--port", type=int, default=DEFUDPPORT, help="udp port of the robot, default %d" % DEFUDPPORT)
+    clparse.add_argument( "-n", "--count", type=int, default=200, help="number of commands to send, default 200")
+    clparse.add_argument( "-r", "--rate", type=float, default=DEFRATE, help="commands per second, default %d" % DEFRATE)
+    clparse.add_argument( "-s", "--speed", type=int, default=300, help="speed to send, default 300")
+    clparse.add_argument('host', help='host name or ip address of the robot')
+    args=clparse.parse_args()
+    res=benchmark(args.host, port=args.port, count=args.count, rate=args.rate, speed=args.speed)
+    print('sent %d, acked %d (%s)' % (res['sent'], res['acked'], ', '.join('%d %s' % (v, k) for k, v in res['statuses'].items())))
+    print('round trip ms: mean %5.2f, 95%% %5.2f, max %5.2f' % (res['rttmean']/1000, res['rtt95']/1000, res['rttmax']/1000))
+    print('motor side ms: mean %5.2f, max %5.2f' % (res['motormean']/1000, res['motormax']/1000))